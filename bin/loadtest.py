@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Load test for the store. Logs in the synthetic shoppers created by
+`manage.py generate_data` and has each of them run shopping journeys in a
+loop against a running server, then prints latency percentiles and
+throughput per route.
+
+    python manage.py generate_data --users 200 --items 5000 --orders 20000
+    python manage.py runserver --noreload   # or gunicorn, against PostgreSQL
+    python bin/loadtest.py --concurrency 20 --duration 60 --user-ids 1-200
+
+Payment goes through payment_done, which marks the order paid without
+talking to PayPal. Card payments are only made with --stripe-token, e.g.
+tok_visa against a server configured with Stripe test keys.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CSRF_COOKIE = 'csrftoken'
+SEARCH_TERMS = ('round', 'black', 'aviator', 'frames', 'titanium', 'glasses', 'retro', 'gold', 'cat',
+                'sun', 'kids', 'slim')
+
+# A 1x1 GIF for prescription uploads; the server re-encodes it like any photo
+PRESCRIPTION_IMAGE = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00'
+                      b'\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+# Relative weights of the journeys each virtual user picks from
+JOURNEYS = (
+    ('browse', 5),
+    ('search', 3),
+    ('purchase', 2),
+    ('lenses', 1),
+    ('abandon', 1),
+    ('api', 2),
+    ('refund', 1),
+)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            self.timings[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def summary(self, elapsed):
+        rows = []
+        for route in sorted(self.timings):
+            timings = sorted(self.timings[route])
+            rows.append({
+                'route': route,
+                'requests': len(timings),
+                'errors': self.errors[route],
+                'rps': len(timings) / elapsed,
+                'p50_ms': percentile(timings, 50) * 1000,
+                'p95_ms': percentile(timings, 95) * 1000,
+                'p99_ms': percentile(timings, 99) * 1000,
+                'max_ms': timings[-1] * 1000,
+            })
+        return rows
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Shopper:
+    def __init__(self, base_url, username, password, stats, catalog, coupon_codes=(), stripe_token=None):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.catalog = catalog
+        self.coupon_codes = coupon_codes
+        self.stripe_token = stripe_token
+        self.session = requests.Session()
+
+    def request(self, route, method, path, expected=(), **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        if method == 'POST':
+            data = kwargs.setdefault('data', {})
+            data['csrfmiddlewaretoken'] = self.session.cookies.get(CSRF_COOKIE, '')
+            kwargs.setdefault('headers', {})['Referer'] = self.base_url + path
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.stats.record(route, time.perf_counter() - started, ok=False)
+            return None
+        ok = response.status_code < 400 or response.status_code in expected
+        self.stats.record(route, time.perf_counter() - started, ok=ok)
+        return response
+
+    def login(self):
+        self.request('login', 'GET', '/accounts/login/')
+        response = self.request('login', 'POST', '/accounts/login/',
+                                data={'login': self.username, 'password': self.password})
+        return response is not None and response.status_code == 302
+
+    def browse(self):
+        self.request('home', 'GET', '/')
+        response = self.request('api:home', 'GET', '/api/?fields=id&page_size=24')
+        if response is not None and response.ok and response.json().get('next'):
+            cursor = re.search(r'cursor=([^&]+)', response.json()['next'])
+            if cursor:
+                self.request('api:home', 'GET', f'/api/?fields=id&cursor={cursor.group(1)}')
+        product = random.choice(self.catalog)
+        self.request('product-detail', 'GET', f'/product/{product["slug"]}')
+        if product['image']:
+            self.request('resized_image', 'GET', f'/img/320x320/{product["image"]}')
+
+    def search(self):
+        self.request('search', 'GET', '/search/', params={'query': random.choice(SEARCH_TERMS)})
+        self.request('search', 'GET', '/search/', params={'query': random.choice(SEARCH_TERMS)[:3]})
+
+    def fill_cart(self, count):
+        products = random.sample(self.catalog, min(len(self.catalog), count))
+        for product in products:
+            self.request('product-detail', 'GET', f'/product/{product["slug"]}')
+            self.request('add_to_cart', 'GET', f'/add-to-cart/{product["slug"]}')
+        return products
+
+    def checkout(self, payment_method):
+        self.request('checkout', 'GET', '/checkout/')
+        if self.coupon_codes and random.random() < 0.3:
+            self.request('add_coupon', 'POST', '/add-coupon/', data={'code': random.choice(self.coupon_codes)})
+        self.request('checkout', 'POST', '/checkout/', data={
+            'use_default_shipping': 'on',
+            'payment_method': payment_method,
+        })
+
+    def pay(self):
+        if self.stripe_token and random.random() < 0.5:
+            self.checkout('S')
+            self.request('stripe_payment', 'GET', '/stripe-payment/')
+            self.request('stripe_payment', 'POST', '/stripe-payment/', data={'stripeToken': self.stripe_token})
+        else:
+            self.checkout('P')
+            self.request('paypal_payment', 'GET', '/paypal-payment/')
+            self.request('payment_done', 'GET', '/payment-done/')
+        self.request('user_profile', 'GET', '/user/')
+
+    def purchase(self):
+        products = self.fill_cart(random.randint(1, 3))
+        self.request('order-summary', 'GET', '/order-summary/')
+        if len(products) > 1:
+            self.request('add_to_cart', 'GET', f'/add-to-cart/{products[0]["slug"]}')
+            self.request('remove_single_item_from_cart', 'GET',
+                         f'/remove-single-item-from-cart/{products[0]["slug"]}')
+            self.request('remove_from_cart', 'GET', f'/remove-from-cart/{products[-1]["slug"]}')
+            self.request('order-summary', 'GET', '/order-summary/')
+        self.pay()
+
+    def lenses(self):
+        slug = self.fill_cart(1)[0]['slug']
+        self.request('add_lenses', 'GET', f'/add-lenses/{slug}')
+        self.request('add_lenses', 'POST', f'/add-lenses/{slug}',
+                     data={'power_type': 'S', 'lenses_type': 'AR'},
+                     files={'prescription_image': ('prescription.gif', PRESCRIPTION_IMAGE, 'image/gif')})
+        self.request('order-summary', 'GET', '/order-summary/')
+        if random.random() < 0.3:
+            self.request('remove_lenses', 'GET', f'/remove-lenses/{slug}')
+        self.pay()
+
+    def abandon(self):
+        # Gets as far as the PayPal page and cancels
+        self.fill_cart(random.randint(1, 2))
+        self.checkout('P')
+        self.request('paypal_payment', 'GET', '/paypal-payment/')
+        self.request('payment_cancelled', 'GET', '/payment-cancelled/')
+
+    def api(self):
+        self.request('api:details', 'GET', f'/api/{random.choice(self.catalog)["slug"]}/')
+        # 400 means the cart is empty
+        self.request('api:order_summary', 'GET', '/api/order-summary/', expected=(400,))
+        self.request('api:user_profile', 'GET', '/api/user-profile/')
+
+    def refund(self):
+        response = self.request('api:user_profile', 'GET', '/api/user-profile/')
+        if response is None or not response.ok:
+            return
+        ref_codes = [order['ref_code'] for order in response.json()['orders']['results'] if order['ref_code']]
+        if not ref_codes:
+            return
+        self.request('refund_request', 'GET', '/refund-request/')
+        self.request('refund_request', 'POST', '/refund-request/', data={
+            'email': f'{self.username}@example.com',
+            'message': 'Load test refund request',
+            'ref_code': random.choice(ref_codes),
+        })
+
+    def run(self, deadline, iterations):
+        if not self.login():
+            return False
+        names, weights = zip(*JOURNEYS)
+        done = 0
+        while time.monotonic() < deadline and (iterations is None or done < iterations):
+            getattr(self, random.choices(names, weights)[0])()
+            done += 1
+        return True
+
+
+def parse_ids(value):
+    ids = []
+    for part in value.split(','):
+        start, _, end = part.partition('-')
+        ids.extend(range(int(start), int(end or start) + 1))
+    return ids
+
+
+def load_catalog(base_url, pages):
+    # Products to visit, read from the API the way a client would
+    products = []
+    url = base_url.rstrip('/') + '/api/?fields=slug,fview&page_size=100'
+    for _ in range(pages):
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        for item in data['results']:
+            # Media URLs look like http://host/media/<name>; /img/ wants <name>
+            image = item['fview'].split('/media/', 1)[-1] if item['fview'] else None
+            products.append({'slug': item['slug'], 'image': image})
+        url = data.get('next')
+        if not url:
+            break
+    return products
+
+
+def print_table(rows, elapsed):
+    header = f'{"route":<30}{"requests":>10}{"errors":>8}{"rps":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}'
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print(f'{row["route"]:<30}{row["requests"]:>10}{row["errors"]:>8}{row["rps"]:>9.1f}'
+              f'{row["p50_ms"]:>10.1f}{row["p95_ms"]:>10.1f}{row["p99_ms"]:>10.1f}{row["max_ms"]:>10.1f}')
+    total = sum(row['requests'] for row in rows)
+    errors = sum(row['errors'] for row in rows)
+    print('-' * len(header))
+    print(f'{total} requests, {errors} errors in {elapsed:.1f}s ({total / elapsed:.1f} requests/s)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=10, help='Number of simultaneous shoppers')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+    parser.add_argument('--iterations', type=int, help='Stop each shopper after this many journeys')
+    parser.add_argument('--user-ids', default='1-100',
+                        help='Ids of the generated users to log in as, e.g. 1-100 or 1,5,9-20')
+    parser.add_argument('--username-format', default='shopper{}')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--catalog-pages', type=int, default=5,
+                        help='API pages of 100 product slugs to pick from')
+    parser.add_argument('--coupons', type=int, default=10,
+                        help='Number of coupons generate_data made; shoppers apply SAVE1..SAVE<n>')
+    parser.add_argument('--stripe-token',
+                        help='Stripe test token (e.g. tok_visa) to also pay by card with')
+    parser.add_argument('--seed', type=int, help='Random seed for the journeys')
+    parser.add_argument('--json', help='Also write the results to this file, for comparing builds')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    catalog = load_catalog(args.base_url, args.catalog_pages)
+    if not catalog:
+        sys.exit('The catalog is empty; run `manage.py generate_data` first.')
+    usernames = [args.username_format.format(pk) for pk in parse_ids(args.user_ids)]
+
+    stats = Stats()
+    started = time.monotonic()
+    deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        coupon_codes = [f'SAVE{pk}' for pk in range(1, args.coupons + 1)]
+        shoppers = [Shopper(args.base_url, usernames[n % len(usernames)], args.password, stats, catalog,
+                            coupon_codes, args.stripe_token)
+                    for n in range(args.concurrency)]
+        results = list(pool.map(lambda shopper: shopper.run(deadline, args.iterations), shoppers))
+    elapsed = time.monotonic() - started
+
+    failed_logins = results.count(False)
+    if failed_logins:
+        print(f'{failed_logins} shoppers could not log in', file=sys.stderr)
+    rows = stats.summary(elapsed)
+    print_table(rows, elapsed)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'elapsed': elapsed, 'concurrency': args.concurrency, 'routes': rows}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
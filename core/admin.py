@@ -1,12 +1,35 @@
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+from django.utils.html import format_html
 
-from .models import OrderItem, Order, Item, Address, Payment, Coupon, UserProfile, EyeLenses
+from . import exports, refunds, tasks
+from .pagination import EstimatedCountPaginator
+from .models import (
+    CATEGORIES_CHOICES, OrderItem, Order, Item, Address, Payment, Coupon, Refund, UserProfile, EyeLenses,
+    DailyItemSales,
+)
 
 
 def make_refund_accepted(modelAdmin, request, queryset):
-    queryset.update(refund_request=False, refund_granted = True)
+    # The processor calls can take a while for thousands of orders, so
+    # they run in the background; process_refunds picks up anything left
+    queued = refunds.queue_orders(queryset)
+    tasks.run_in_background(refunds.process_refunds)
+    modelAdmin.message_user(request, f'Queued {queued} refunds for processing')
 
-make_refund_accepted.short_description = 'Update Refund Granted to accepted'
+make_refund_accepted.short_description = 'Grant and process refunds for selected orders'
+
+def export_orders_csv(modelAdmin, request, queryset):
+    return exports.export_response(queryset, 'csv')
+
+export_orders_csv.short_description = 'Export selected orders as CSV'
+
+def export_orders_jsonl(modelAdmin, request, queryset):
+    return exports.export_response(queryset, 'jsonl')
+
+export_orders_jsonl.short_description = 'Export selected orders as JSON Lines'
 
 class OrderAdmin(admin.ModelAdmin):
     ordering = ['ordered', 'order_date']
@@ -22,8 +45,6 @@ class OrderAdmin(admin.ModelAdmin):
                     'coupon',
                     'payment',
                     'ref_code',
-                    'delivered',
-                    'received',
                     'failed_confirm',
                     'in_process_delivery',   
     ]
@@ -38,14 +59,19 @@ class OrderAdmin(admin.ModelAdmin):
                     'received',  
                     
     ]
+    # Address and Payment __str__ use their user, so follow those FKs too
+    list_select_related = ['user', 'shipping_address__user', 'coupon', 'payment__user']
 
+    # Searches match a whole username or ref code with a plain, case-sensitive
+    # = so the unique indexes on those columns serve them; partial terms find
+    # nothing. Django's own search lookups (=, ^ or none) compare UPPER(column)
+    # or use LIKE '%term%', which those indexes can't serve
     search_fields = [
         'user__username',
         'ref_code',
     ]
     list_filter = [
                     'ordered',
-                    'order_date',
                     'delivered',
                     'received',
                     'refund_request',
@@ -54,8 +80,22 @@ class OrderAdmin(admin.ModelAdmin):
                     'in_process_delivery',   
 
     ]
+    date_hierarchy = 'order_date'
+    raw_id_fields = ['user', 'items', 'shipping_address', 'coupon', 'payment']
+
+    # Counting millions of orders on every page load is what makes the
+    # changelist slow, so use estimates and skip the unfiltered total
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
-    actions = [make_refund_accepted]
+    actions = [make_refund_accepted, export_orders_csv, export_orders_jsonl]
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        users = get_user_model().objects.filter(username=term)
+        return queryset.filter(Q(ref_code=term) | Q(user__in=users)), False
 
 class AddressAdmin(admin.ModelAdmin):
     list_display = [
@@ -81,6 +121,119 @@ class AddressAdmin(admin.ModelAdmin):
     list_filter = ['default', 'address_type', 'country']
 
 
+def queue_refunds(modelAdmin, request, queryset):
+    queued = refunds.queue(queryset)
+    tasks.run_in_background(refunds.process_refunds)
+    modelAdmin.message_user(request, f'Queued {queued} refunds for processing')
+
+queue_refunds.short_description = 'Process selected refunds (requested or failed)'
+
+class RefundAdmin(admin.ModelAdmin):
+    list_display = [
+        'pk',
+        'order',
+        'email',
+        'status',
+        'accepted',
+        'attempts',
+        'processed',
+        'processor_reference',
+        'error',
+    ]
+    list_filter = ['status', 'accepted']
+    list_select_related = ['order__user']
+    search_fields = ['email']
+    raw_id_fields = ['order']
+    readonly_fields = ['status', 'accepted', 'attempts', 'processed', 'processor_reference', 'error']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = [queue_refunds]
+
+    def get_search_results(self, request, queryset, search_term):
+        # An order's ref code is matched whole and case-sensitively, as in
+        # OrderAdmin, so its unique index serves it
+        results, use_distinct = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if term:
+            results |= queryset.filter(order__ref_code=term)
+        return results, use_distinct
+
+
+class EyeLensesAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'power_type',
+        'lenses_type',
+        'date',
+        'prescription_preview',
+    ]
+    list_select_related = ['user']
+    readonly_fields = ['prescription_large_preview']
+
+    def preview(self, obj, size):
+        if not obj.prescription_image:
+            return '-'
+        url = reverse('core:resized_image', args=(size, size, obj.prescription_image.name))
+        return format_html('<a href="{}"><img src="{}" alt="prescription"></a>', obj.prescription_image.url, url)
+
+    def prescription_preview(self, obj):
+        return self.preview(obj, 80)
+    prescription_preview.short_description = 'Prescription'
+
+    def prescription_large_preview(self, obj):
+        return self.preview(obj, 600)
+    prescription_large_preview.short_description = 'Prescription preview'
+
+
+class DailyItemSalesAdmin(admin.ModelAdmin):
+    # Reads only the rollup table; see core.reports
+    list_display = [
+        'date',
+        'item',
+        'category',
+        'orders',
+        'units',
+        'gross',
+        'discount',
+        'revenue',
+        'refunded_units',
+        'refunded_amount',
+    ]
+    list_filter = ['category', 'date']
+    list_select_related = ['item']
+    date_hierarchy = 'date'
+    search_fields = ['item__title']
+    ordering = ['-date', '-revenue']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        changelist = getattr(response, 'context_data', {}).get('cl')
+        if changelist is not None:
+            categories = dict(CATEGORIES_CHOICES)
+            summary = (
+                changelist.queryset.order_by()
+                .values('category')
+                .annotate(
+                    items=Count('item', distinct=True),
+                    units=Sum('units'),
+                    gross=Sum('gross'),
+                    discount=Sum('discount'),
+                    revenue=Sum('revenue'),
+                    refunded_amount=Sum('refunded_amount'),
+                )
+                .order_by('-revenue')
+            )
+            response.context_data['category_summary'] = [
+                dict(row, category=categories.get(row['category'], row['category'])) for row in summary
+            ]
+        return response
+
     
 admin.site.register(Item)
 
@@ -94,6 +247,10 @@ admin.site.register(Payment)
 
 admin.site.register(Coupon)
 
+admin.site.register(Refund, RefundAdmin)
+
 admin.site.register(UserProfile)
 
-admin.site.register(EyeLenses)
+admin.site.register(EyeLenses, EyeLensesAdmin)
+
+admin.site.register(DailyItemSales, DailyItemSalesAdmin)
@@ -0,0 +1,67 @@
+import hashlib
+
+from django.utils.http import urlencode
+
+from core import caching
+from core.models import Item, Order
+
+# ETag / Last-Modified functions for django.views.decorators.http.condition.
+# They run after DRF has authenticated the request and picked a renderer, and
+# must stay cheaper than the view itself: at most one small query each.
+
+
+def weak_etag(*parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def representation(request):
+    # ?fields= and the cursor change the body, and so does the renderer
+    query = urlencode(sorted(request.GET.items()))
+    renderer = getattr(request, 'accepted_renderer', None)
+    return query, getattr(renderer, 'format', '')
+
+
+def catalog_etag(request, *args, **kwargs):
+    return weak_etag('catalog', caching.get_catalog_version(), *representation(request))
+
+
+def _item(slug):
+    try:
+        return caching.get_item_by_slug(slug)
+    except (Item.DoesNotExist, Item.MultipleObjectsReturned):
+        return None
+
+
+def item_etag(request, slug):
+    item = _item(slug)
+    if item is None:
+        return None
+    return weak_etag('item', item.pk, item.modified.isoformat(), *representation(request))
+
+
+def item_last_modified(request, slug):
+    item = _item(slug)
+    return item.modified if item is not None else None
+
+
+def _open_order(request):
+    if not hasattr(request, '_open_order_marker'):
+        request._open_order_marker = (Order.objects
+                                      .filter(user=request.user, ordered=False)
+                                      .values_list('pk', 'modified')
+                                      .first())
+    return request._open_order_marker
+
+
+def order_summary_etag(request, *args, **kwargs):
+    marker = _open_order(request)
+    if marker is None:
+        return None
+    pk, modified = marker
+    return weak_etag('order', pk, modified.isoformat(), *representation(request))
+
+
+def order_summary_last_modified(request, *args, **kwargs):
+    marker = _open_order(request)
+    return marker[1] if marker is not None else None
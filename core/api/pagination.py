@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ItemCursorPagination(CursorPagination):
+    """
+    Pages the catalog newest-first with an opaque cursor, so a page costs one
+    indexed query however deep the client has scrolled and items added while
+    paging never shift or repeat results.
+    """
+    ordering = '-pk'
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class OrderHistoryPagination(CursorPagination):
+    ordering = '-pk'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
@@ -1,8 +1,32 @@
 from rest_framework import serializers
-from core.models import Item, OrderItem, Order, UserProfile
+from core.models import Item, OrderItem, Order, UserProfile, EyeLenses
 from django.conf import settings
 
-class ItemSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """
+    Lets a client ask for a subset of fields with ?fields=title,slug,price,
+    or a view pass fields=[...] directly. Unknown names are ignored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is None:
+            request = self.context.get('request')
+            fields = requested_fields(request) if request is not None else None
+        if fields and set(fields) & set(self.fields):
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    value = request.query_params.get('fields')
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class ItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Item
         fields = '__all__'
@@ -17,10 +41,45 @@ class RegistrationSerializer(serializers.ModelSerializer):
             'password': {'write_only': True}
         }
     
+class OrderLineItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Item
+        fields = ['id', 'title', 'slug', 'price', 'discount_price', 'fview']
+
+
+class EyeLensesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EyeLenses
+        fields = ['id', 'power_type', 'lenses_type', 'prescription_image', 'processed']
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    item = OrderLineItemSerializer(read_only=True)
+    lenses = EyeLensesSerializer(read_only=True)
+    final_price = serializers.FloatField(source='get_final_price', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'item', 'quantity', 'lenses_required', 'lenses', 'final_price']
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    """
+    Read-only order with its lines nested. Expects a queryset built with
+    Order.objects.with_lines() so the lines, items and lenses are prefetched.
+    """
+    items = OrderItemSerializer(many=True, read_only=True)
+    coupon = serializers.CharField(source='coupon.code', read_only=True)
+
     class Meta:
         model = Order
-        fields = '__all__'
+        fields = [
+            'id', 'ref_code', 'ordered', 'start_date', 'order_date', 'modified',
+            'coupon', 'subtotal', 'discount', 'total', 'items',
+            'in_process_delivery', 'delivered', 'received', 'failed_confirm',
+            'remark_for_failure', 'refund_request', 'refund_granted',
+        ]
+        read_only_fields = fields
         
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,23 @@
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+CHUNK_SIZE = 500
+
+
+def stream_json(queryset, serializer, chunk_size=CHUNK_SIZE):
+    """
+    Yields the queryset as a JSON array one row at a time. Rows are read with
+    .iterator() and serialized as they arrive, so memory stays flat however
+    large the queryset is.
+    """
+    encoder = JSONEncoder()
+    yield '['
+    for index, instance in enumerate(queryset.iterator(chunk_size=chunk_size)):
+        if index:
+            yield ','
+        yield encoder.encode(serializer.to_representation(instance))
+    yield ']'
+
+
+def streaming_json_response(queryset, serializer):
+    return StreamingHttpResponse(stream_json(queryset, serializer), content_type='application/json')
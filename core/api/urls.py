@@ -5,7 +5,7 @@ from django.urls import path, include
 
 
 from core.api.views import (
-    hello, HomeView, ProductDetail,
+    hello, HomeView, ItemStream, ProductDetail,
     OrderSummary, UserProfileView,
 )
 
@@ -18,6 +18,7 @@ urlpatterns = [
     path('user-profile/', UserProfileView.as_view(), name='user_profile'),
     path('hello/', hello, name='hello'),
     path('', HomeView.as_view(), name='home'),
+    path('items/stream/', ItemStream.as_view(), name='item_stream'),
     path('<slug>/', ProductDetail.as_view(), name='details'),
 
 
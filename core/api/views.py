@@ -5,11 +5,18 @@ from rest_framework.views import APIView
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
+from core import caching
 from core.models import Item, Order, UserProfile
 
 
+from core.api import conditional
+from core.api.pagination import ItemCursorPagination, OrderHistoryPagination
 from core.api.serializers import ItemSerializer, OrderSerializer, UserProfileSerializer
+from core.api.streaming import streaming_json_response
 
 
 
@@ -22,15 +29,31 @@ def hello(request):
 
 
 class HomeView(APIView):
+    @method_decorator(condition(etag_func=conditional.catalog_etag))
     def get(self, request):
-        items = Item.objects.all()
-        serializers = ItemSerializer(items, many=True)
-        return Response(serializers.data)    
+        paginator = ItemCursorPagination()
+        fields = ItemSerializer(context={'request': request}).fields
+        items = paginator.paginate_queryset(Item.objects.only(*fields), request, view=self)
+        serializers = ItemSerializer(items, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializers.data)
+
+
+class ItemStream(APIView):
+    """
+    The whole catalog as one JSON array, streamed row by row for clients that
+    sync everything at once. Accepts the same ?fields= as HomeView.
+    """
+
+    def get(self, request):
+        serializer = ItemSerializer(context={'request': request})
+        return streaming_json_response(Item.objects.only(*serializer.fields).order_by('pk'), serializer)
 
 class ProductDetail(APIView):
+    @method_decorator(condition(etag_func=conditional.item_etag,
+                                last_modified_func=conditional.item_last_modified))
     def get(self, request, slug):
         try:
-            item = Item.objects.get(slug=slug)
+            item = caching.get_item_by_slug(slug)
             serializers = ItemSerializer(item)
             return Response(serializers.data)    
         except Exception as e:
@@ -41,11 +64,14 @@ class OrderSummary(APIView):
     permission_classes = [IsAuthenticated,]
     authentication = [TokenAuthentication,]
 
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=conditional.order_summary_etag,
+                                last_modified_func=conditional.order_summary_last_modified))
     def get(self, request, format=None):
         content = {}
         try:
-            order = Order.objects.get(user=request.user, ordered=False)
-            serializer = OrderSerializer(order)
+            order = Order.objects.with_lines().get(user=request.user, ordered=False)
+            serializer = OrderSerializer(order, context={'request': request})
             content = serializer.data
             return Response(content)
         except ObjectDoesNotExist:
@@ -57,16 +83,21 @@ class UserProfileView(APIView):
 
     def get(self, request, format=None):
         try:
-            order = Order.objects.filter(user=request.user, ordered=True)
-            order_Serializer = OrderSerializer(order, many=True)
-            # print(order_Serializer.data)
-
             user_profile = UserProfile.objects.get(user=request.user)
-            user_profile_Serializer = UserProfileSerializer(user_profile)
+            user_profile_Serializer = UserProfileSerializer(user_profile, context={'request': request})
+
+            paginator = OrderHistoryPagination()
+            orders = paginator.paginate_queryset(
+                Order.objects.with_lines().filter(user=request.user, ordered=True), request, view=self)
+            order_Serializer = OrderSerializer(orders, many=True, context={'request': request})
 
             context = {
                 "user_profile" : user_profile_Serializer.data, 
-                "orders": order_Serializer.data,
+                "orders": {
+                    "next": paginator.get_next_link(),
+                    "previous": paginator.get_previous_link(),
+                    "results": order_Serializer.data,
+                },
             }
             return Response(context, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
@@ -0,0 +1,183 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from . import datagen, search
+from .api.serializers import ItemSerializer, OrderSerializer
+from .middleware import QueryRecorder
+from .models import Item, Order, OrderItem
+from .templatetags.cart_template_tags import cart_item_count
+from .templatetags.category_template_tags import in_category
+
+# Micro-benchmarks for the hot model and helper paths, run against generated
+# data. Each result is the fastest of several timed calls (the least disturbed
+# by other work on the machine) and the number of queries one call ran. compare() checks results against a stored baseline: time may grow
+# by the threshold factor, the query count may not grow at all.
+
+SIZES = {
+    'small': {'users': 50, 'items': 500, 'orders': 500, 'carts': 25},
+    'medium': {'users': 500, 'items': 5000, 'orders': 5000, 'carts': 250},
+    'large': {'users': 5000, 'items': 50000, 'orders': 50000, 'carts': 2500},
+}
+SEED = 1
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json')
+# Differences smaller than this are timer noise, whatever the ratio
+MIN_SLOWDOWN = 0.001
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+# Each benchmark takes the data set and returns the function to time.
+
+@benchmark
+def order_totals(data):
+    def run():
+        for order in Order.objects.filter(ordered=True).order_by('pk')[:100]:
+            order.get_total_bill_amount()
+            order.get_total_bill_amount_with_discount()
+    return run
+
+
+@benchmark
+def orderitem_final_price(data):
+    def run():
+        return sum(line.get_final_price()
+                   for line in OrderItem.objects.select_related('item').order_by('pk')[:500])
+    return run
+
+
+@benchmark
+def cart_item_count_cold(data):
+    def run():
+        cache.clear()
+        for user in data['users']:
+            cart_item_count(user)
+    return run
+
+
+@benchmark
+def cart_item_count_warm(data):
+    for user in data['users']:
+        cart_item_count(user)
+
+    def run():
+        for user in data['users']:
+            cart_item_count(user)
+    return run
+
+
+@benchmark
+def in_category_page(data):
+    def run():
+        return list(in_category(None, 'FS')[:24])
+    return run
+
+
+@benchmark
+def search_words(data):
+    return lambda: search.search('round black eyeglasses', limit=24)
+
+
+@benchmark
+def search_prefix(data):
+    return lambda: search.search('avi', limit=24)
+
+
+@benchmark
+def item_serializer(data):
+    def run():
+        return ItemSerializer(Item.objects.order_by('pk')[:500], many=True).data
+    return run
+
+
+@benchmark
+def order_serializer(data):
+    def run():
+        return OrderSerializer(Order.objects.with_lines().filter(ordered=True).order_by('pk')[:50], many=True).data
+    return run
+
+
+def generate(size):
+    datagen.generate(seed=SEED, **SIZES[size])
+    users = list(get_user_model().objects.order_by('pk')[:20])
+    return {'users': users}
+
+
+def measure(func, repeat):
+    func()  # warm up
+    timings = []
+    recorder = QueryRecorder()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    with connection.execute_wrapper(recorder):
+        func()
+    return {'seconds': round(min(timings), 6), 'queries': recorder.count}
+
+
+def run(size, repeat=7, names=None):
+    """
+    Generates the data set for size and runs the benchmarks on it.
+    Returns {name: {'seconds': ..., 'queries': ...}}.
+    """
+    data = generate(size)
+    return {
+        name: measure(setup(data), repeat)
+        for name, setup in BENCHMARKS.items()
+        if names is None or name in names
+    }
+
+
+def run_isolated(size, repeat=7, names=None):
+    # Generated rows are rolled back so the database is left as it was
+    with transaction.atomic():
+        results = run(size, repeat, names)
+        transaction.set_rollback(True)
+    cache.clear()
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(size, results, path=BASELINE_PATH):
+    baseline = load_baseline(path)
+    baseline[size] = results
+    with open(path, 'w') as fp:
+        json.dump(baseline, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+
+def compare(results, baseline, threshold=None):
+    """
+    Returns a message per benchmark that regressed against the baseline.
+    """
+    threshold = threshold or settings.BENCHMARK_THRESHOLD
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries, baseline {expected["queries"]}')
+        slower = result['seconds'] - expected['seconds']
+        if result['seconds'] > expected['seconds'] * threshold and slower > MIN_SLOWDOWN:
+            regressions.append(f'{name}: {result["seconds"] * 1000:.2f}ms, baseline '
+                               f'{expected["seconds"] * 1000:.2f}ms (threshold x{threshold})')
+    return regressions
@@ -0,0 +1,89 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+
+from .models import Item, OrderItem
+
+CART_COUNT_TIMEOUT = 60 * 60 * 24
+CATALOG_TIMEOUT = 60 * 15
+PRODUCT_TIMEOUT = 60 * 60
+
+CATALOG_VERSION_KEY = 'catalog-version'
+
+
+def cart_count_key(user_id):
+    return f'cart-count:{user_id}'
+
+
+def get_cart_count(user):
+    key = cart_count_key(user.pk)
+    count = cache.get(key)
+    if count is None:
+        count = OrderItem.objects.filter(order__user=user, order__ordered=False).count()
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def set_cart_count(user_id, count):
+    # Only once the change is committed, so a rollback can't leave its count behind
+    transaction.on_commit(lambda: cache.set(cart_count_key(user_id), count, CART_COUNT_TIMEOUT))
+
+
+def invalidate_cart_count(user_id):
+    # Again on commit, in case a request cached the old count in between
+    cache.delete(cart_count_key(user_id))
+    transaction.on_commit(lambda: cache.delete(cart_count_key(user_id)))
+
+
+# Anything derived from the Item table (listing pages, counts, the product
+# grid fragment) is cached under the current catalog version. Saving or
+# deleting an Item bumps the version, which orphans all of those entries at once.
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost version never reuses old keys
+        version = int(time.time() * 1000)
+        cache.add(CATALOG_VERSION_KEY, version, None)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+
+
+def catalog_key(*parts):
+    raw = ':'.join(str(part) for part in parts)
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'catalog:{get_catalog_version()}:{digest}'
+
+
+# Product pages: the Item itself is cached by slug for both the web and the
+# API views, and product_page.html caches its rendered body per Item.
+
+def product_key(slug):
+    return f'item:{slug}'
+
+
+def get_item_by_slug(slug):
+    """
+    Returns the Item for the slug, raising Item.DoesNotExist when there is none.
+    """
+    key = product_key(slug)
+    item = cache.get(key)
+    if item is None:
+        item = Item.objects.get(slug=slug)
+        cache.set(key, item, PRODUCT_TIMEOUT)
+    return item
+
+
+def invalidate_product(item, *slugs):
+    cache.delete_many([product_key(slug) for slug in {item.slug, *slugs}])
+    cache.delete(make_template_fragment_key('product_detail', [item.pk]))
@@ -0,0 +1,252 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import caching, tasks, uploads
+from .models import EyeLenses, Item, Order, OrderItem
+
+SESSION_KEY = 'cart'
+
+# Every mutation runs in one transaction with the user's open order row
+# locked, so concurrent clicks for the same user are applied one after the
+# other. Quantities are changed with F() expressions and the database
+# guarantees at most one open Order and one open line per item for a user.
+
+
+def get_open_order(user, create=False, lock=False):
+    orders = Order.objects.filter(user=user, ordered=False)
+    if lock:
+        orders = orders.select_for_update()
+    order = orders.first()
+    if order is None and create:
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(user=user, order_date=timezone.now())
+        except IntegrityError:
+            # Another request created the open order first
+            order = orders.get()
+    return order
+
+
+def cart_lines(user):
+    # Open lines that are in the user's cart. Older code could leave open
+    # lines outside any order; add_item puts them back when the item is added.
+    return OrderItem.objects.filter(user=user, ordered=False, order__user=user, order__ordered=False)
+
+
+def get_line(user, item):
+    return (cart_lines(user)
+            .select_related('item', 'lenses')
+            .filter(item=item)
+            .first())
+
+
+def _touch_order(user):
+    # Lenses don't change the totals but do change what the cart looks like
+    Order.objects.filter(user=user, ordered=False).update(modified=timezone.now())
+
+
+def _refresh_order(order):
+    line_count = order.update_totals()
+    caching.set_cart_count(order.user_id, line_count)
+
+
+def add_item(user, item):
+    """
+    Adds one unit of the item to the user's cart.
+    Returns the cart line and whether it was newly created.
+    """
+    with transaction.atomic():
+        order = get_open_order(user, create=True, lock=True)
+        line, created = OrderItem.objects.get_or_create(user=user, item=item, ordered=False)
+        if not created:
+            OrderItem.objects.filter(pk=line.pk).update(quantity=F('quantity') + 1)
+        # Adding a line that is already in the cart changes nothing, and puts
+        # back one that was left outside it. Either way the m2m_changed signal
+        # refreshes the totals and the cart count.
+        order.items.add(line)
+    return line, created
+
+
+def remove_item(user, item):
+    """
+    Removes the item's line from the user's cart.
+    Returns False when the item was not in the cart.
+    """
+    with transaction.atomic():
+        order = get_open_order(user, lock=True)
+        if order is None:
+            return False
+        # Deleting the line drops it from the order; the delete signals
+        # refresh the totals and the cart count
+        deleted, _ = OrderItem.objects.filter(user=user, item=item, ordered=False).delete()
+    return bool(deleted)
+
+
+def remove_single_item(user, item):
+    """
+    Takes one unit of the item out of the user's cart, removing the line
+    when it was the last one. Returns False when the item was not in the cart.
+    """
+    with transaction.atomic():
+        order = get_open_order(user, lock=True)
+        if order is None:
+            return False
+        lines = OrderItem.objects.filter(user=user, item=item, ordered=False)
+        if lines.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+            _refresh_order(order)
+            return True
+        deleted, _ = lines.delete()
+    return bool(deleted)
+
+
+def attach_lenses(user, item, power_type, lenses_type, prescription_image):
+    """
+    Attaches a lenses requirement to the item's cart line.
+    Returns the updated line, or None when the item is not in the cart.
+    """
+    with transaction.atomic():
+        line = (cart_lines(user)
+                .select_for_update()
+                .filter(item=item)
+                .first())
+        if line is None:
+            return None
+        line.lenses = EyeLenses.objects.create(
+            power_type=power_type,
+            lenses_type=lenses_type,
+            prescription_image=prescription_image,
+            user=user,
+        )
+        line.lenses_required = True
+        OrderItem.objects.filter(pk=line.pk).update(lenses=line.lenses, lenses_required=True)
+        _touch_order(user)
+        tasks.run_in_background(uploads.process_prescription, line.lenses.pk)
+    return line
+
+
+def detach_lenses(user, item):
+    """
+    Removes the lenses requirement from the item's cart line.
+    Returns the line (None when the item is not in the cart) and whether
+    lenses were attached.
+    """
+    with transaction.atomic():
+        line = (cart_lines(user)
+                .select_for_update()
+                .filter(item=item)
+                .first())
+        if line is None or not line.lenses_required:
+            return line, False
+        OrderItem.objects.filter(pk=line.pk).update(lenses=None, lenses_required=False)
+        _touch_order(user)
+        if line.lenses_id:
+            EyeLenses.objects.filter(pk=line.lenses_id).delete()
+        line.lenses = None
+        line.lenses_required = False
+    return line, True
+
+
+class CartLines(list):
+    # Lets templates use cart.items.all / cart.items.count on a SessionCart
+    def all(self):
+        return self
+
+    def count(self):
+        return len(self)
+
+
+class SessionCart:
+    """
+    Cart for visitors who are not logged in. Lines live in the session as
+    {item_id: quantity} and are only written to the database when the visitor
+    logs in (see merge_session_cart). Quacks like an Order for the cart templates.
+    """
+    coupon = None
+
+    def __init__(self, session):
+        self.session = session
+        self.lines = session.get(SESSION_KEY, {})
+
+    def __len__(self):
+        return len(self.lines)
+
+    def save(self):
+        self.session[SESSION_KEY] = self.lines
+        self.session.modified = True
+
+    def add_item(self, item):
+        key = str(item.pk)
+        created = key not in self.lines
+        self.lines[key] = self.lines.get(key, 0) + 1
+        self.save()
+        return created
+
+    def remove_item(self, item):
+        if self.lines.pop(str(item.pk), None) is None:
+            return False
+        self.save()
+        return True
+
+    def remove_single_item(self, item):
+        key = str(item.pk)
+        if key not in self.lines:
+            return False
+        if self.lines[key] > 1:
+            self.lines[key] -= 1
+        else:
+            del self.lines[key]
+        self.save()
+        return True
+
+    @cached_property
+    def items(self):
+        items = Item.objects.in_bulk([int(pk) for pk in self.lines])
+        return CartLines(
+            OrderItem(item=items[int(pk)], quantity=quantity)
+            for pk, quantity in self.lines.items()
+            if int(pk) in items
+        )
+
+    def get_total_bill_amount(self):
+        return sum(line.get_final_price() for line in self.items)
+
+    def get_total_bill_amount_with_discount(self):
+        return self.get_total_bill_amount()
+
+
+def merge_session_cart(session, user):
+    """
+    Moves the session cart into the user's open Order in one transaction,
+    using one bulk insert for new lines and one UPDATE for existing ones.
+    """
+    lines = session.pop(SESSION_KEY, None)
+    if not lines:
+        return
+    quantities = {int(pk): quantity for pk, quantity in lines.items()}
+    item_ids = set(Item.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+    if not item_ids:
+        return
+
+    with transaction.atomic():
+        order = get_open_order(user, create=True, lock=True)
+        existing = dict(OrderItem.objects
+                        .filter(user=user, ordered=False, item_id__in=item_ids)
+                        .values_list('item_id', 'pk'))
+        if existing:
+            OrderItem.objects.filter(pk__in=existing.values()).update(quantity=F('quantity') + Case(
+                *[When(pk=pk, then=Value(quantities[item_id])) for item_id, pk in existing.items()],
+                output_field=IntegerField(),
+            ))
+
+        new_ids = item_ids - set(existing)
+        if new_ids:
+            OrderItem.objects.bulk_create([
+                OrderItem(user=user, item_id=item_id, quantity=quantities[item_id])
+                for item_id in new_ids
+            ])
+        # bulk_create doesn't return pks on every backend, so read them back.
+        # Existing lines are added too, in case one was left outside the cart;
+        # adding the lines refreshes the totals and the cart count.
+        order.items.add(*OrderItem.objects.filter(user=user, ordered=False, item_id__in=item_ids))
@@ -0,0 +1,272 @@
+import os
+import random
+import string
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import caching, search
+from .models import (
+    CATEGORIES_CHOICES, LABEL_CHOICES, LENSES_TYPES_CHOICES, POWER_TYPES_CHOICES,
+    Address, Coupon, EyeLenses, Item, Order, OrderItem, Payment, Refund, UserProfile,
+)
+
+# Synthetic data for load tests and benchmarks. Rows are written with
+# bulk_create and explicit primary keys (bulk_create can't return pks on
+# every backend), so each batch is a handful of INSERTs whatever its size.
+# Signals don't fire: totals are set directly and the search index and the
+# catalog cache are refreshed at the end.
+
+DEFAULT_PASSWORD = 'loadtest-password'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+ADJECTIVES = ('Classic', 'Round', 'Square', 'Aviator', 'Cat Eye', 'Retro', 'Slim', 'Bold',
+              'Rimless', 'Titanium', 'Acetate', 'Matte', 'Tortoise', 'Oversized', 'Kids')
+NOUNS = ('Eyeglasses', 'Frames', 'Sunglasses', 'Readers', 'Spectacles', 'Computer Glasses')
+COLOURS = ('Black', 'Gold', 'Silver', 'Blue', 'Havana', 'Crystal', 'Red', 'Green', 'Grey')
+WORDS = ('lightweight', 'durable', 'frame', 'lens', 'comfortable', 'hinge', 'fit', 'scratch',
+         'resistant', 'coating', 'uv', 'protection', 'everyday', 'style', 'premium', 'glasses')
+STREETS = ('Main Street', 'MG Road', 'Park Avenue', 'Station Road', 'Lake View', 'Hill Road')
+COUNTRIES = ('IN', 'US', 'GB', 'DE', 'AE', 'CA', 'AU')
+
+
+def next_pk(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def reset_sequences(*models):
+    # Explicit pks leave PostgreSQL sequences behind; a no-op on SQLite
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def chunks(start, count, size):
+    for offset in range(0, count, size):
+        yield start + offset, min(size, count - offset)
+
+
+def sample_images():
+    """
+    Names of the images already in MEDIA_ROOT, which generated Items point at
+    so pages render real files without copying anything.
+    """
+    try:
+        names = os.listdir(settings.MEDIA_ROOT)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def generate_users(rng, count, password=DEFAULT_PASSWORD, batch_size=1000):
+    """
+    Creates count users named shopper<pk> who can all log in with password,
+    each with a profile and a default shipping and billing address.
+    Returns their pks.
+    """
+    User = get_user_model()
+    # Hashing is deliberately slow, so every user shares one hash
+    password_hash = make_password(password)
+    start = next_pk(User)
+    address_pk = next_pk(Address)
+    for first, size in chunks(start, count, batch_size):
+        pks = range(first, first + size)
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(pk=pk, username=f'shopper{pk}', email=f'shopper{pk}@example.com', password=password_hash)
+                for pk in pks
+            ])
+            UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in pks])
+            addresses = []
+            for pk in pks:
+                street = f'{rng.randint(1, 999)} {rng.choice(STREETS)}'
+                country = rng.choice(COUNTRIES)
+                zip_code = str(rng.randint(100000, 999999))
+                for address_type in ('S', 'B'):
+                    addresses.append(Address(
+                        pk=address_pk, user_id=pk, street_address=street,
+                        apartment_address=f'Flat {rng.randint(1, 200)}', country=country,
+                        zip_code=zip_code, address_type=address_type, default=True,
+                    ))
+                    address_pk += 1
+            Address.objects.bulk_create(addresses)
+    reset_sequences(User, UserProfile, Address)
+    return list(range(start, start + count))
+
+
+def generate_coupons(rng, count):
+    start = next_pk(Coupon)
+    Coupon.objects.bulk_create([
+        Coupon(pk=pk, code=f'SAVE{pk}', percentage=rng.choice((5, 10, 15, 20, 25)))
+        for pk in range(start, start + count)
+    ])
+    reset_sequences(Coupon)
+    return list(Coupon.objects.filter(pk__gte=start).values_list('pk', 'percentage'))
+
+
+def generate_items(rng, count, batch_size=1000, index=True):
+    """
+    Creates count Items with images from MEDIA_ROOT and adds them to the
+    search index. Returns {pk: final price}.
+    """
+    images = sample_images()
+    categories = [code for code, name in CATEGORIES_CHOICES]
+    labels = [code for code, name in LABEL_CHOICES]
+    start = next_pk(Item)
+    prices = {}
+    for first, size in chunks(start, count, batch_size):
+        items = []
+        for pk in range(first, first + size):
+            title = f'{rng.choice(ADJECTIVES)} {rng.choice(COLOURS)} {rng.choice(NOUNS)}'
+            price = float(rng.randrange(499, 9999, 100))
+            discount_price = round(price * rng.choice((0.7, 0.8, 0.9)), 2) if rng.random() < 0.3 else None
+            items.append(Item(
+                pk=pk, title=title, slug=f'{slugify(title)}-{pk}', price=price,
+                discount_price=discount_price, category=rng.choice(categories),
+                label=rng.choice(labels), description=sentence(rng, 30), features=sentence(rng, 15),
+                fview=rng.choice(images) if images else None,
+                sview=rng.choice(images) if images else None,
+            ))
+            prices[pk] = discount_price or price
+        with transaction.atomic():
+            Item.objects.bulk_create(items)
+            if index:
+                search.index_items(items)
+    reset_sequences(Item)
+    caching.bump_catalog_version()
+    return prices
+
+
+def ref_code(rng, pk):
+    return ''.join(rng.choices(string.ascii_lowercase + string.digits, k=12)) + f'{pk:08d}'
+
+
+def generate_orders(rng, count, user_pks, item_prices, coupons=(), ordered=True,
+                    lenses_rate=0.2, refund_rate=0.02, days=365, batch_size=500):
+    """
+    Creates orders with 1-4 lines each and their stored totals. Completed
+    orders also get a Payment, and a share of them a Refund request. Open
+    carts are created for distinct users, since a user has at most one.
+    """
+    item_pks = list(item_prices)
+    if not ordered:
+        # Users who already have an open cart can't get another
+        busy = set(Order.objects.filter(ordered=False).values_list('user_id', flat=True))
+        user_pks = [pk for pk in user_pks if pk not in busy]
+        count = min(count, len(user_pks))
+        cart_users = iter(rng.sample(user_pks, count))
+    power_types = [code for code, name in POWER_TYPES_CHOICES]
+    lenses_types = [code for code, name in LENSES_TYPES_CHOICES]
+    images = sample_images()
+    now = timezone.now()
+
+    order_pk = next_pk(Order)
+    line_pk = next_pk(OrderItem)
+    lenses_pk = next_pk(EyeLenses)
+    payment_pk = next_pk(Payment)
+    refund_pk = next_pk(Refund)
+    address_by_user = {}
+
+    for first, size in chunks(order_pk, count, batch_size):
+        orders, lines, links, lenses, payments, refunds = [], [], [], [], [], []
+        batch_users = [next(cart_users) if not ordered else rng.choice(user_pks) for _ in range(size)]
+        missing = set(batch_users) - set(address_by_user)
+        address_by_user.update(Address.objects
+                               .filter(user_id__in=missing, address_type='S', default=True)
+                               .values_list('user_id', 'pk'))
+        for pk, user_pk in zip(range(first, first + size), batch_users):
+            subtotal = 0
+            for item_pk in rng.sample(item_pks, min(len(item_pks), rng.randint(1, 4))):
+                quantity = rng.choice((1, 1, 1, 2, 3))
+                line = OrderItem(pk=line_pk, item_id=item_pk, user_id=user_pk, quantity=quantity, ordered=ordered)
+                if rng.random() < lenses_rate:
+                    lenses.append(EyeLenses(
+                        pk=lenses_pk, user_id=user_pk, power_type=rng.choice(power_types),
+                        lenses_type=rng.choice(lenses_types), processed=True,
+                        prescription_image=rng.choice(images) if images else None,
+                    ))
+                    line.lenses_id = lenses_pk
+                    line.lenses_required = True
+                    lenses_pk += 1
+                lines.append(line)
+                links.append(Order.items.through(order_id=pk, orderitem_id=line_pk))
+                subtotal += item_prices[item_pk] * quantity
+                line_pk += 1
+
+            coupon_pk, percentage = rng.choice(coupons) if coupons and rng.random() < 0.2 else (None, 0)
+            order_date = now - timedelta(seconds=rng.randint(0, days * 86400))
+            order = Order(
+                pk=pk, user_id=user_pk, ordered=ordered, order_date=order_date, coupon_id=coupon_pk,
+                shipping_address_id=address_by_user.get(user_pk),
+                **Order.calculate_totals(subtotal, percentage)
+            )
+            if ordered:
+                order.ref_code = ref_code(rng, pk)
+                order.payment_id = payment_pk
+                payments.append(Payment(pk=payment_pk, user_id=user_pk, amount=order.total,
+                                        transaction_id=str(pk)))
+                payment_pk += 1
+                order.delivered = order.received = order_date < now - timedelta(days=7)
+                if rng.random() < refund_rate:
+                    order.refund_request = True
+                    refunds.append(Refund(pk=refund_pk, order_id=pk, email=f'shopper{user_pk}@example.com',
+                                          message=sentence(rng, 20)))
+                    refund_pk += 1
+            orders.append(order)
+
+        with transaction.atomic():
+            EyeLenses.objects.bulk_create(lenses)
+            OrderItem.objects.bulk_create(lines)
+            Payment.objects.bulk_create(payments)
+            Order.objects.bulk_create(orders)
+            Order.items.through.objects.bulk_create(links)
+            Refund.objects.bulk_create(refunds)
+            if payments:
+                # time_stamp is auto_now_add; date each payment on its order instead
+                Payment.objects.filter(pk__in=[payment.pk for payment in payments]).update(
+                    time_stamp=Subquery(Order.objects.filter(payment=OuterRef('pk')).values('order_date')[:1])
+                )
+        yield len(orders), len(lines)
+
+    reset_sequences(EyeLenses, OrderItem, Payment, Order, Order.items.through, Refund)
+
+
+def generate(seed=0, users=100, items=1000, orders=1000, carts=50, coupons=10,
+             lenses_rate=0.2, refund_rate=0.02, password=DEFAULT_PASSWORD, batch_size=1000, log=None):
+    """
+    Generates a complete data set. The same seed against the same starting
+    database produces the same rows.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+
+    user_pks = generate_users(rng, users, password, batch_size)
+    log(f'{len(user_pks)} users')
+    coupon_rows = generate_coupons(rng, coupons)
+    log(f'{len(coupon_rows)} coupons')
+    item_prices = generate_items(rng, items, batch_size)
+    log(f'{len(item_prices)} items')
+    if not user_pks or not item_prices:
+        return
+
+    done = 0
+    for order_count, line_count in generate_orders(rng, orders, user_pks, item_prices, coupon_rows,
+                                                   lenses_rate=lenses_rate, refund_rate=refund_rate,
+                                                   batch_size=batch_size):
+        done += order_count
+        log(f'{done} completed orders')
+    for order_count, line_count in generate_orders(rng, carts, user_pks, item_prices, coupon_rows,
+                                                   ordered=False, lenses_rate=lenses_rate,
+                                                   batch_size=batch_size):
+        log(f'{order_count} open carts')
@@ -0,0 +1,159 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Refund
+from .reports import in_chunks
+
+# Order exports for reconciling payments and refunds. Orders are read in
+# primary key chunks with everything they reference prefetched (a few queries
+# per chunk) and written out as they are read, so a year of orders streams in
+# constant memory. CSV has a row per order line, JSON Lines an object per order.
+
+CHUNK_SIZE = 500
+
+CSV_COLUMNS = (
+    'order_id', 'ref_code', 'username', 'order_date', 'ordered', 'delivered', 'received',
+    'refund_request', 'refund_granted', 'coupon', 'coupon_percentage', 'subtotal', 'discount', 'total',
+    'street_address', 'apartment_address', 'country', 'zip_code',
+    'transaction_id', 'payment_amount', 'paid_at',
+    'payment_refunded', 'refund_ids', 'refunds_accepted', 'refund_statuses',
+    'item_id', 'item_slug', 'item_title', 'quantity', 'line_price', 'lenses_type', 'power_type',
+)
+
+
+class Echo:
+    # csv.writer wants a file; this one hands each line back instead of storing it
+    def write(self, value):
+        return value
+
+
+def export_queryset(queryset):
+    return queryset.select_related('user', 'shipping_address', 'coupon', 'payment').prefetch_related(
+        Prefetch('refund_set', queryset=Refund.objects.order_by('pk'))
+    )
+
+
+def iter_orders(queryset, chunk_size=CHUNK_SIZE):
+    for orders in in_chunks(export_queryset(queryset), chunk_size):
+        yield from orders
+
+
+def order_record(order):
+    address = order.shipping_address
+    payment = order.payment
+    return {
+        'id': order.pk,
+        'ref_code': order.ref_code,
+        'username': order.user.username,
+        'order_date': order.order_date,
+        'ordered': order.ordered,
+        'delivered': order.delivered,
+        'received': order.received,
+        'refund_request': order.refund_request,
+        'refund_granted': order.refund_granted,
+        'coupon': order.coupon.code if order.coupon else None,
+        'coupon_percentage': order.coupon.percentage if order.coupon else None,
+        'subtotal': order.subtotal,
+        'discount': order.discount,
+        'total': order.total,
+        'shipping_address': {
+            'street_address': address.street_address,
+            'apartment_address': address.apartment_address,
+            'country': address.country.code,
+            'zip_code': address.zip_code,
+        } if address else None,
+        'payment': {
+            'transaction_id': payment.transaction_id,
+            'amount': payment.amount,
+            'time_stamp': payment.time_stamp,
+            'refunded': payment.refunded,
+        } if payment else None,
+        'refunds': [
+            {'id': refund.pk, 'email': refund.email, 'message': refund.message, 'accepted': refund.accepted,
+             'status': refund.status, 'processor_reference': refund.processor_reference}
+            for refund in order.refund_set.all()
+        ],
+        'lines': [
+            {
+                'item_id': line.item_id,
+                'slug': line.item.slug,
+                'title': line.item.title,
+                'quantity': line.quantity,
+                'price': line.get_final_price(),
+                'lenses_type': line.lenses.lenses_type if line.lenses else None,
+                'power_type': line.lenses.power_type if line.lenses else None,
+            }
+            for line in order.items.all()
+        ],
+    }
+
+
+def csv_rows(record):
+    address = record['shipping_address'] or {}
+    payment = record['payment'] or {}
+    refunds = record['refunds']
+    row = {
+        'order_id': record['id'],
+        'ref_code': record['ref_code'],
+        'username': record['username'],
+        'order_date': record['order_date'].isoformat(),
+        'ordered': record['ordered'],
+        'delivered': record['delivered'],
+        'received': record['received'],
+        'refund_request': record['refund_request'],
+        'refund_granted': record['refund_granted'],
+        'coupon': record['coupon'],
+        'coupon_percentage': record['coupon_percentage'],
+        'subtotal': record['subtotal'],
+        'discount': record['discount'],
+        'total': record['total'],
+        'street_address': address.get('street_address'),
+        'apartment_address': address.get('apartment_address'),
+        'country': address.get('country'),
+        'zip_code': address.get('zip_code'),
+        'transaction_id': payment.get('transaction_id'),
+        'payment_amount': payment.get('amount'),
+        'paid_at': payment['time_stamp'].isoformat() if payment else None,
+        'payment_refunded': payment.get('refunded'),
+        'refund_ids': ' '.join(str(refund['id']) for refund in refunds),
+        'refunds_accepted': ' '.join(str(refund['accepted']) for refund in refunds),
+        'refund_statuses': ' '.join(refund['status'] for refund in refunds),
+    }
+    if not record['lines']:
+        yield row
+    for line in record['lines']:
+        yield dict(row, item_id=line['item_id'], item_slug=line['slug'], item_title=line['title'],
+                   quantity=line['quantity'], line_price=line['price'],
+                   lenses_type=line['lenses_type'], power_type=line['power_type'])
+
+
+def stream_csv(queryset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order in iter_orders(queryset, chunk_size):
+        for row in csv_rows(order_record(order)):
+            yield writer.writerow([row.get(column) for column in CSV_COLUMNS])
+
+
+def stream_jsonl(queryset, chunk_size=CHUNK_SIZE):
+    encoder = DjangoJSONEncoder()
+    for order in iter_orders(queryset, chunk_size):
+        yield encoder.encode(order_record(order)) + '\n'
+
+
+FORMATS = {
+    'csv': (stream_csv, 'text/csv'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson'),
+}
+
+
+def export_response(queryset, file_format):
+    stream, content_type = FORMATS[file_format]
+    response = StreamingHttpResponse(stream(queryset), content_type=content_type)
+    filename = timezone.localtime().strftime('orders-%Y%m%d-%H%M%S')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{file_format}"'
+    return response
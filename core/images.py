@@ -0,0 +1,183 @@
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# Listing pages use these instead of the uploaded originals. Each variant is
+# stored beside the original as <name>.<variant>.<ext>, e.g.
+# media/Item/frame.jpg -> media/Item/frame.jpg.card.webp. The original's
+# extension stays in, so frame.jpg and frame.png get variants of their own.
+VARIANTS = {
+    'thumb': (320, 320),
+    'card': (640, 640),
+}
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+QUALITY = 82
+
+
+def variant_name(name, variant, extension):
+    return f'{name}.{variant}.{extension}'
+
+
+def variant_names(name):
+    return [variant_name(name, variant, extension) for variant in VARIANTS for extension in FORMATS]
+
+
+def open_image(fp):
+    image = Image.open(fp)
+    # Phone uploads are often stored sideways with an EXIF rotation flag
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+def encode(image, extension, quality=QUALITY):
+    image_format, _ = FORMATS[extension]
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def resize(image, size):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+
+def generate_variants(field_file, storage=default_storage):
+    """
+    Writes every size/format variant of an uploaded image next to it.
+    Returns the names written.
+    """
+    if not field_file:
+        return []
+    with field_file.storage.open(field_file.name, 'rb') as fp:
+        original = open_image(fp)
+        original.load()
+
+    written = []
+    for variant, size in VARIANTS.items():
+        image = resize(original, size)
+        for extension in FORMATS:
+            name = variant_name(field_file.name, variant, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            written.append(storage.save(name, ContentFile(encode(image, extension))))
+    return written
+
+
+def delete_variants(name, storage=default_storage):
+    for variant in variant_names(name):
+        if storage.exists(variant):
+            storage.delete(variant)
+
+
+def variant_url(field_file, variant, extension, storage=default_storage):
+    """
+    URL of a variant, or of the original while the variant hasn't been generated.
+    """
+    if not field_file:
+        return ''
+    name = variant_name(field_file.name, variant, extension)
+    if storage.exists(name):
+        return storage.url(name)
+    return field_file.url
+
+
+def srcset(field_file, extension, storage=default_storage):
+    candidates = []
+    for variant, (width, height) in VARIANTS.items():
+        name = variant_name(field_file.name, variant, extension)
+        if storage.exists(name):
+            candidates.append(f'{storage.url(name)} {width}w')
+    return ', '.join(candidates)
+
+
+class ResizeCache:
+    """
+    On-disk cache of resized media files for the /img/ endpoint. Entries are
+    keyed by the source path, its size and mtime, so replacing an upload
+    produces a new entry. Reads bump an entry's mtime; when the cache grows
+    past max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        # Bytes cached as of the last scan plus what this process wrote since.
+        # Other processes write too, so it is only a trigger: evict() rescans.
+        self.size = None
+
+    def key(self, source_path, width, height, extension):
+        stat = os.stat(source_path)
+        raw = f'{source_path}:{stat.st_size}:{stat.st_mtime_ns}:{width}x{height}'
+        return hashlib.sha1(raw.encode()).hexdigest() + '.' + extension
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get_or_create(self, source_path, width, height, extension):
+        """
+        Returns the cache key and path of the resized image, creating it on a miss.
+        """
+        key = self.key(source_path, width, height, extension)
+        path = self.path(key)
+        try:
+            os.utime(path)
+            return key, path
+        except FileNotFoundError:
+            pass
+
+        with open(source_path, 'rb') as fp:
+            data = encode(resize(open_image(fp), (width, height)), extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent requests never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+        if self.size is None:
+            self.size = sum(entry.stat().st_size for entry in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.size = self.evict()
+        return key, path
+
+    def entries(self):
+        for directory in os.scandir(self.root):
+            if directory.is_dir():
+                for entry in os.scandir(directory.path):
+                    if entry.is_file():
+                        yield entry
+
+    def evict(self):
+        """
+        Deletes the least recently used entries when the cache is over budget.
+        Returns the bytes left in the cache.
+        """
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self.entries()]
+        total = sum(size for mtime, size, path in entries)
+        if total <= self.max_bytes:
+            return total
+        # Trim to 90% of the budget so the cache isn't walked again for a while
+        target = self.max_bytes * 0.9
+        for mtime, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
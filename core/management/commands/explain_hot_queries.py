@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.models import Address, Coupon, Item, Order, OrderItem
+
+# Plan fragments that show the database read the table through an index, or
+# scanned all of it, per backend.
+INDEX_MARKERS = {
+    'sqlite': ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY'),
+    'postgresql': ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'),
+}
+SCAN_MARKERS = {
+    'sqlite': ('SCAN TABLE', 'SCAN '),
+    'postgresql': ('Seq Scan',),
+}
+
+
+def hot_queries():
+    user_id = get_user_model().objects.values_list('pk', flat=True).first() or 1
+    item_id = Item.objects.values_list('pk', flat=True).first() or 1
+    ref_code = Order.objects.exclude(ref_code=None).values_list('ref_code', flat=True).first() or 'x' * 20
+    code = Coupon.objects.values_list('code', flat=True).first() or 'CODE'
+    return [
+        ('open order (every cart view)',
+         Order.objects.filter(user_id=user_id, ordered=False)),
+        ('order history (UserProfileView)',
+         Order.objects.filter(user_id=user_id, ordered=True)),
+        ('cart line (add/remove cart)',
+         OrderItem.objects.filter(item_id=item_id, user_id=user_id, ordered=False)),
+        ('order by ref_code (RefundRequest)',
+         Order.objects.filter(ref_code=ref_code)),
+        ('coupon by code (get_coupon)',
+         Coupon.objects.filter(code=code)),
+        ('default shipping address (Checkout)',
+         Address.objects.filter(user_id=user_id, address_type='S', default=True)),
+        ('item by slug (ProductDetail)',
+         Item.objects.filter(slug='slug')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the hot-path queries and reports whether each one uses an index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help='Exit with an error when any query scans a whole table')
+        parser.add_argument('--force-index', action='store_true',
+                            help='On PostgreSQL, disable sequential scans so small dev '
+                                 'tables report the plan a large table would get')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in INDEX_MARKERS:
+            raise CommandError(f'EXPLAIN checks are not supported on {vendor}')
+
+        if options['force_index'] and vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+        scans = []
+        for name, queryset in hot_queries():
+            plan = queryset.explain()
+            uses_index = any(marker in plan for marker in INDEX_MARKERS[vendor])
+            scans_table = any(marker in plan for marker in SCAN_MARKERS[vendor])
+            if uses_index and not scans_table:
+                self.stdout.write(self.style.SUCCESS(f'INDEX  {name}'))
+            else:
+                scans.append(name)
+                self.stdout.write(self.style.WARNING(f'SCAN   {name}'))
+            if options['verbosity'] > 1 or not uses_index:
+                for line in plan.splitlines():
+                    self.stdout.write(f'         {line}')
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f'{len(scans)} hot queries scan a whole table: {", ".join(scans)}')
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import datagen
+
+
+class Command(BaseCommand):
+    help = ('Fills the database with synthetic users, items, carts, orders, payments, '
+            'coupons and refunds for load tests and benchmarks')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed generates the same data')
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--items', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=1000, help='Number of completed orders')
+        parser.add_argument('--carts', type=int, default=50, help='Number of open carts')
+        parser.add_argument('--coupons', type=int, default=10)
+        parser.add_argument('--lenses-rate', type=float, default=0.2,
+                            help='Share of order lines that have lenses attached')
+        parser.add_argument('--refund-rate', type=float, default=0.02,
+                            help='Share of completed orders with a refund request')
+        parser.add_argument('--password', default=datagen.DEFAULT_PASSWORD,
+                            help='Password for every generated user')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per bulk insert transaction')
+
+    def handle(self, *args, **options):
+        counts = ('users', 'items', 'orders', 'carts', 'coupons', 'batch_size')
+        if any(options[name] < 0 for name in counts) or options['batch_size'] < 1:
+            raise CommandError('Counts must not be negative and --batch-size must be at least 1')
+        for name in ('lenses_rate', 'refund_rate'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f'--{name.replace("_", "-")} must be between 0 and 1')
+
+        started = time.monotonic()
+
+        def log(message):
+            self.stdout.write(f'[{time.monotonic() - started:7.1f}s] {message}')
+
+        datagen.generate(
+            seed=options['seed'], users=options['users'], items=options['items'],
+            orders=options['orders'], carts=options['carts'], coupons=options['coupons'],
+            lenses_rate=options['lenses_rate'], refund_rate=options['refund_rate'],
+            password=options['password'], batch_size=options['batch_size'], log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Done in {time.monotonic() - started:.1f}s. '
+            f'Users can log in as shopper<id> with password {options["password"]!r}'
+        ))
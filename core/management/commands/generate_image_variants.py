@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core import images
+from core.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnail and WebP variants for every Item image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Skip images whose variants already exist')
+
+    def handle(self, *args, **options):
+        generated = 0
+        for item in Item.objects.only('pk', 'fview', 'sview').iterator():
+            for field_file in (item.fview, item.sview):
+                if not field_file:
+                    continue
+                if options['missing_only'] and images.srcset(field_file, 'webp'):
+                    continue
+                try:
+                    images.generate_variants(field_file)
+                    generated += 1
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f'Item {item.pk}: {field_file.name}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {generated} images'))
@@ -0,0 +1,199 @@
+import csv
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core import caching, search
+from core.models import CATEGORIES_CHOICES, LABEL_CHOICES, Item, Order
+
+TEXT_FIELDS = ('title', 'description', 'features', 'category', 'label')
+PRICE_FIELDS = ('price', 'discount_price')
+IMAGE_FIELDS = ('fview', 'sview')
+CATEGORIES = {code for code, name in CATEGORIES_CHOICES}
+LABELS = {code for code, name in LABEL_CHOICES}
+
+
+def read_rows(path, file_format):
+    """
+    Yields (row dict, line number) from a CSV or JSON Lines file one row at a
+    time, so the file is never loaded whole.
+    """
+    with open(path, newline='', encoding='utf-8') as fp:
+        if file_format == 'csv':
+            reader = csv.DictReader(fp)
+            for row in reader:
+                yield row, reader.line_num
+        else:
+            for line_number, line in enumerate(fp, 1):
+                if line.strip():
+                    yield json.loads(line), line_number
+
+
+class RowError(ValueError):
+    pass
+
+
+def clean_row(row):
+    row = {key.strip(): value.strip() if isinstance(value, str) else value
+           for key, value in row.items() if key}
+    if not row.get('title'):
+        raise RowError('title is required')
+    row['slug'] = slugify(row.get('slug') or row['title'])
+    if not row['slug']:
+        raise RowError('slug is empty')
+    if row.get('category') not in CATEGORIES:
+        raise RowError(f'unknown category {row.get("category")!r}')
+    if row.get('label', 'P') not in LABELS:
+        raise RowError(f'unknown label {row.get("label")!r}')
+    row.setdefault('label', 'P')
+    for field in PRICE_FIELDS:
+        value = row.get(field)
+        if value in (None, ''):
+            if field in row:
+                row[field] = None
+            continue
+        try:
+            row[field] = float(value)
+        except (TypeError, ValueError):
+            raise RowError(f'{field} is not a number: {value!r}')
+    if row.get('price') is None:
+        raise RowError('price is required')
+    return row
+
+
+class Command(BaseCommand):
+    help = ('Imports Items from a CSV or JSON Lines catalog file, creating new items '
+            'and updating existing ones matched by slug')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=os.path.join(settings.BASE_DIR, 'catalog.jsonl'),
+                            help='Catalog file (default: catalog.jsonl in the project root)')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='File format; guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rows written per transaction')
+        parser.add_argument('--images-dir',
+                            help='Directory that relative image paths are resolved against '
+                                 '(default: the directory of the catalog file)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            self.stderr.write(self.style.WARNING(f'No catalog file at {path}, nothing to import'))
+            return
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        self.images_dir = options['images_dir'] or os.path.dirname(os.path.abspath(path))
+        self.upload_to = Item._meta.get_field('fview').upload_to
+
+        self.created = self.updated = self.skipped = 0
+        started = time.monotonic()
+        batch = {}
+        try:
+            for row, line_number in read_rows(path, file_format):
+                try:
+                    row = clean_row(row)
+                except RowError as e:
+                    self.skipped += 1
+                    self.stderr.write(f'Line {line_number}: {e}')
+                    continue
+                # A slug repeated within a batch: the last row wins
+                batch[row['slug']] = row
+                if len(batch) >= options['batch_size']:
+                    self.write_batch(batch)
+                    batch = {}
+                    self.report(started)
+        except (UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+            raise CommandError(f'Could not read {path}: {e}')
+        if batch:
+            self.write_batch(batch)
+        self.report(started)
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.created + self.updated} items '
+            f'({self.created} created, {self.updated} updated, {self.skipped} skipped). '
+            f'Run generate_image_variants --missing-only to build the image variants.'
+        ))
+
+    def report(self, started):
+        elapsed = time.monotonic() - started
+        done = self.created + self.updated
+        rate = done / elapsed if elapsed else 0
+        self.stdout.write(f'{done} items in {elapsed:.1f}s ({rate:.0f}/s), {self.skipped} skipped')
+
+    def image_name(self, value):
+        """
+        Storage name for an image column: files already in MEDIA_ROOT are used
+        in place, anything else is copied into the Item upload directory.
+        """
+        if not value:
+            return None
+        source = value if os.path.isabs(value) else os.path.join(self.images_dir, value)
+        if os.path.isfile(source):
+            name = os.path.join(self.upload_to, os.path.basename(source))
+            # Re-running an import shouldn't copy the same file again
+            if default_storage.exists(name) and default_storage.size(name) == os.path.getsize(source):
+                return name
+            with open(source, 'rb') as fp:
+                return default_storage.save(name, File(fp))
+        if default_storage.exists(value):
+            return value
+        self.stderr.write(f'Image not found: {value}')
+        return None
+
+    def apply(self, item, row):
+        for field in TEXT_FIELDS:
+            if row.get(field):
+                setattr(item, field, row[field])
+        for field in PRICE_FIELDS:
+            if field in row:
+                setattr(item, field, row[field])
+        for field in IMAGE_FIELDS:
+            name = self.image_name(row.get(field))
+            if name:
+                setattr(item, field, name)
+
+    def write_batch(self, batch):
+        # Signals don't fire for bulk writes, so this does by hand what the
+        # Item save signals would: reindex, clear caches and reprice carts.
+        with transaction.atomic():
+            existing = {}
+            for item in Item.objects.filter(slug__in=batch).order_by('pk'):
+                existing.setdefault(item.slug, item)
+
+            now = timezone.now()
+            to_update = []
+            for slug, item in existing.items():
+                self.apply(item, batch[slug])
+                item.modified = now
+                to_update.append(item)
+            Item.objects.bulk_update(to_update, TEXT_FIELDS + PRICE_FIELDS + IMAGE_FIELDS + ('modified',))
+
+            to_create = []
+            for slug, row in batch.items():
+                if slug not in existing:
+                    item = Item(slug=slug)
+                    self.apply(item, row)
+                    to_create.append(item)
+            Item.objects.bulk_create(to_create)
+
+            # bulk_create doesn't return pks on every backend
+            created = list(Item.objects.filter(slug__in=[item.slug for item in to_create])
+                           .exclude(pk__in=[item.pk for item in to_update]))
+            search.index_items(to_update + created)
+            if to_update:
+                Order.objects.filter(ordered=False, items__item__in=to_update).recompute_totals()
+
+        for item in to_update:
+            caching.invalidate_product(item)
+        caching.bump_catalog_version()
+        self.created += len(to_create)
+        self.updated += len(to_update)
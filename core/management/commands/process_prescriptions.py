@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core import uploads
+from core.models import EyeLenses
+
+
+class Command(BaseCommand):
+    help = 'Re-encodes prescription uploads that have not been processed yet'
+
+    def handle(self, *args, **options):
+        pending = (EyeLenses.objects
+                   .filter(processed=False)
+                   .exclude(prescription_image='')
+                   .exclude(prescription_image=None)
+                   .values_list('pk', flat=True))
+        processed = 0
+        for pk in pending.iterator():
+            try:
+                uploads.process_prescription(pk)
+                processed += 1
+            except (OSError, ValueError) as e:
+                self.stderr.write(f'EyeLenses {pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} prescriptions'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import refunds
+from core.models import Refund
+
+
+class Command(BaseCommand):
+    help = ('Sends queued refunds to the payment processor. Safe to re-run after a failure: '
+            'refunds that already went through are not refunded twice, and refunds a failed '
+            'run left processing are sent again after REFUND_CLAIM_TIMEOUT')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=refunds.CHUNK_SIZE,
+                            help='Refunds claimed from the queue at a time')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue refunds that failed before processing the queue')
+        parser.add_argument('--requeue-processing', action='store_true',
+                            help='Queue refunds left processing by a run that died, without waiting for '
+                                 'REFUND_CLAIM_TIMEOUT. Only use when no other run is going')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if options['retry_failed']:
+            queued = refunds.queue(Refund.objects.filter(status='F'))
+            self.stdout.write(f'Queued {queued} failed refunds again')
+        if options['requeue_processing']:
+            queued = refunds.requeue_processing()
+            self.stdout.write(f'Queued {queued} unfinished refunds again')
+        refunded, failed = refunds.process_refunds(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refunded {refunded} orders, {failed} failed'))
+        if failed:
+            self.stderr.write(self.style.WARNING('See the errors on the failed refunds in the admin'))
@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import reports
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily item sales rollups from the order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Orders loaded per query')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        written = reports.rebuild(since, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} daily item sales rows'))
+        undated = reports.undated_refunds().count()
+        if undated:
+            self.stdout.write(self.style.WARNING(
+                f'Left out the refunds of {undated} orders with no recorded grant date'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+from core.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for every Item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of items indexed per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        indexed = 0
+        batch = []
+        for item in Item.objects.order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                search.index_items(batch)
+                indexed += len(batch)
+                batch = []
+                self.stdout.write(f'Indexed {indexed} items')
+        search.index_items(batch)
+        indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {indexed} items'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Runs the model and helper micro-benchmarks against generated data and '
+            'compares them with the stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(benchmarks.SIZES), default='small')
+        parser.add_argument('--repeat', type=int, default=7, help='Timed runs per benchmark')
+        parser.add_argument('--only', nargs='+', choices=sorted(benchmarks.BENCHMARKS),
+                            help='Run only these benchmarks')
+        parser.add_argument('--threshold', type=float,
+                            help='Allowed slowdown factor (default: settings.BENCHMARK_THRESHOLD)')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Store these results as the new baseline instead of comparing')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        self.stdout.write(f'Generating the {size} data set...')
+        results = benchmarks.run_isolated(size, options['repeat'], options['only'])
+        baseline = benchmarks.load_baseline().get(size, {})
+
+        for name, result in results.items():
+            expected = baseline.get(name)
+            line = f'{name:<24}{result["seconds"] * 1000:>10.2f}ms{result["queries"]:>6} queries'
+            if expected:
+                line += f'   (baseline {expected["seconds"] * 1000:.2f}ms, {expected["queries"]} queries)'
+            self.stdout.write(line)
+
+        if options['update_baseline']:
+            benchmarks.save_baseline(size, results)
+            self.stdout.write(self.style.SUCCESS(f'Baseline for {size} updated'))
+            return
+        regressions = benchmarks.compare(results, baseline, options['threshold'])
+        if regressions:
+            raise CommandError('Benchmarks regressed:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it only gzip is offered
+    brotli = None
+
+MIN_LENGTH = 200
+
+logger = logging.getLogger('core.performance')
+
+INSTRUMENTED_MODULES = ('core.views', 'core.api.views')
+# Collapses "IN (%s, %s, %s)" so the same query over different lists matches
+PLACEHOLDER_LIST_RE = re.compile(r'%s(?:, %s)+')
+# How many of the most repeated queries a request's log line names
+TOP_DUPLICATES = 5
+
+
+def accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def brotli_sequence(sequence):
+    compressor = brotli.Compressor()
+    for item in sequence:
+        chunk = compressor.process(item)
+        if chunk:
+            yield chunk
+    yield compressor.finish()
+
+
+class APICompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses core.api responses with brotli when the client accepts it and
+    the package is installed, otherwise with gzip. Works like Django's
+    GZipMiddleware (including for streaming responses) but leaves the HTML
+    pages alone, since those embed CSRF tokens (BREACH).
+    """
+
+    def process_response(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        if match is None or 'api' not in match.namespaces:
+            return response
+        if response.has_header('Content-Encoding') or response.status_code != 200:
+            return response
+        if not response.streaming and len(response.content) < MIN_LENGTH:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encodings = accepted_encodings(request)
+        if brotli is not None and 'br' in encodings:
+            encoding = 'br'
+        elif 'gzip' in encodings:
+            encoding = 'gzip'
+        else:
+            return response
+
+        if response.streaming:
+            content = response.streaming_content
+            response.streaming_content = (brotli_sequence(content) if encoding == 'br'
+                                          else compress_sequence(content))
+            del response['Content-Length']
+        else:
+            compressed = (brotli.compress(response.content) if encoding == 'br'
+                          else compress_string(response.content))
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(response.content))
+
+        # The body bytes differ per encoding, so a strong ETag must be weakened
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+def fingerprint(sql):
+    return PLACEHOLDER_LIST_RE.sub('%s, ...', sql)
+
+
+def fingerprint_id(fingerprint):
+    # Short enough for a header; the log line maps it back to the SQL
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper() hook that counts and times every query.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for sql, duration in self.queries)
+
+    def duplicates(self):
+        """
+        {fingerprint: times run} for statements run more than once, which is
+        what an N+1 loop looks like.
+        """
+        counts = Counter(fingerprint(sql) for sql, duration in self.queries)
+        return {sql: times for sql, times in counts.items() if times > 1}
+
+
+class QueryStats:
+    def __init__(self, view, recorder, duration):
+        self.view = view
+        self.count = recorder.count
+        self.db_time = recorder.duration
+        self.duplicates = recorder.duplicates()
+        self.duration = duration
+        self.queries = [sql for sql, query_duration in recorder.queries]
+
+    def as_dict(self):
+        return {
+            'view': self.view,
+            'queries': self.count,
+            'db_ms': round(self.db_time * 1000, 1),
+            'duplicate_queries': sum(self.duplicates.values()) - len(self.duplicates),
+            'top_duplicates': [
+                {'id': fingerprint_id(sql), 'times': times, 'sql': sql}
+                for sql, times in self.top_duplicates()
+            ],
+            'total_ms': round(self.duration * 1000, 1),
+            # Time outside the database: view code and template rendering
+            'app_ms': round((self.duration - self.db_time) * 1000, 1),
+        }
+
+    def top_duplicates(self, limit=TOP_DUPLICATES):
+        return sorted(self.duplicates.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+
+class QueryCountMiddleware:
+    """
+    Records the queries, database time and total time of every request served
+    by a core view. The numbers, with the most repeated queries, are logged
+    as one JSON line on the core.performance logger, added as X-Query-*
+    headers when DEBUG is on, and left on response.query_stats for tests
+    (see core.testing).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        view = getattr(request, '_instrumented_view', None)
+        if view is None:
+            return response
+
+        stats = QueryStats(view, recorder, time.perf_counter() - started)
+        response.query_stats = stats
+        data = stats.as_dict()
+        logger.info(json.dumps(dict(data, method=request.method, path=request.path, status=response.status_code)))
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(data['queries'])
+            response['X-Query-Time-Ms'] = str(data['db_ms'])
+            response['X-Duplicate-Queries'] = str(data['duplicate_queries'])
+            if data['top_duplicates']:
+                # <fingerprint id>=<times run>, most repeated first
+                response['X-Duplicate-Query-Fingerprints'] = ', '.join(
+                    f'{duplicate["id"]}={duplicate["times"]}' for duplicate in data['top_duplicates']
+                )
+            response['X-Request-Time-Ms'] = str(data['total_ms'])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        module = getattr(view_func, '__module__', '')
+        if module in INSTRUMENTED_MODULES:
+            request._instrumented_view = f'{module}.{view_func.__name__}'
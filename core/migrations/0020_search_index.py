@@ -0,0 +1,79 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:29
+
+import re
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.html import strip_tags
+
+# A copy of core.search's tokenizer as it was when the index was added, so
+# later changes to the app don't change what this migration does
+
+FIELD_WEIGHTS = (
+    ('title', 3),
+    ('description', 1),
+    ('features', 1),
+)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_TERM_LENGTH = 64
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with',
+))
+
+
+def tokenize(text):
+    tokens = TOKEN_RE.findall(strip_tags(text or '').lower())
+    return [t for t in tokens if t not in STOP_WORDS and len(t) <= MAX_TERM_LENGTH]
+
+
+def document_terms(item):
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(getattr(item, field)):
+            counts[token] += weight
+    return counts
+
+
+def build_search_index(apps, schema_editor):
+    Item = apps.get_model('core', 'Item')
+    SearchDocument = apps.get_model('core', 'SearchDocument')
+    SearchTerm = apps.get_model('core', 'SearchTerm')
+    for item in Item.objects.iterator():
+        counts = document_terms(item)
+        SearchDocument.objects.create(item_id=item.pk, length=sum(counts.values()))
+        SearchTerm.objects.bulk_create([
+            SearchTerm(document_id=item.pk, term=term, frequency=frequency)
+            for term, frequency in counts.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_order_remark_for_failure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='core.Item')),
+                ('length', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='core.SearchDocument')),
+            ],
+            options={
+                'unique_together': {('term', 'document')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:31
+
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def final_price_expression(prefix=''):
+    # A copy of core.models.final_price_expression as it was when the totals
+    # were added, so later changes to the app don't change this migration
+    no_discount = (Q(**{prefix + 'item__discount_price__isnull': True}) |
+                   Q(**{prefix + 'item__discount_price': 0}))
+    return ExpressionWrapper(
+        F(prefix + 'quantity') * Case(
+            When(no_discount, then=F(prefix + 'item__price')),
+            default=F(prefix + 'item__discount_price'),
+        ),
+        output_field=models.FloatField(),
+    )
+
+
+def calculate_order_totals(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    rows = Order.objects.annotate(
+        computed_subtotal=Coalesce(Sum(final_price_expression('items__')), Value(0.0)),
+        coupon_percentage=Coalesce(F('coupon__percentage'), Value(0.0)),
+    ).values_list('pk', 'computed_subtotal', 'coupon_percentage')
+    for pk, subtotal, percentage in rows:
+        discount = subtotal * (percentage/100)
+        Order.objects.filter(pk=pk).update(subtotal=subtotal, discount=discount, total=subtotal - discount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(calculate_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:33
+
+from django.db import migrations, models
+from django.db.models import Case, Count, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+
+def final_price_expression(prefix=''):
+    # Copied from 0021_order_totals; migrations don't import app code
+    no_discount = (Q(**{prefix + 'item__discount_price__isnull': True}) |
+                   Q(**{prefix + 'item__discount_price': 0}))
+    return ExpressionWrapper(
+        F(prefix + 'quantity') * Case(
+            When(no_discount, then=F(prefix + 'item__price')),
+            default=F(prefix + 'item__discount_price'),
+        ),
+        output_field=models.FloatField(),
+    )
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+
+    merged_users = set()
+
+    # Fold every extra open order of a user into the oldest one
+    duplicated = (Order.objects.filter(ordered=False)
+                  .values('user').annotate(open_orders=Count('pk'))
+                  .filter(open_orders__gt=1).values_list('user', flat=True))
+    for user_id in duplicated:
+        merged_users.add(user_id)
+        keep, *extra = Order.objects.filter(user_id=user_id, ordered=False).order_by('pk')
+        for order in extra:
+            keep.items.add(*order.items.all())
+            order.delete()
+
+    # Fold every extra open line for the same item into the oldest one
+    duplicated = (OrderItem.objects.filter(ordered=False)
+                  .values('user', 'item').annotate(lines=Count('pk'))
+                  .filter(lines__gt=1).values_list('user', 'item'))
+    for user_id, item_id in duplicated:
+        merged_users.add(user_id)
+        lines = OrderItem.objects.filter(user_id=user_id, item_id=item_id, ordered=False).order_by('pk')
+        keep = lines[0]
+        quantity = lines.aggregate(quantity=Sum('quantity'))['quantity']
+        for line in lines[1:]:
+            for order in line.order_set.all():
+                order.items.add(keep)
+            line.delete()
+        keep.quantity = quantity
+        keep.save()
+
+    # Open lines outside any order: the old remove-from-cart view only unlinked
+    # them and deleting a cart in the admin leaves them behind. They go back
+    # into their user's cart, or are deleted when the user has no cart.
+    detached = list(OrderItem.objects.filter(ordered=False, order=None))
+    carts = dict(Order.objects.filter(ordered=False, user_id__in={line.user_id for line in detached})
+                 .values_list('user_id', 'pk'))
+    Order.items.through.objects.bulk_create([
+        Order.items.through(order_id=carts[line.user_id], orderitem_id=line.pk)
+        for line in detached if line.user_id in carts
+    ])
+    OrderItem.objects.filter(pk__in=[line.pk for line in detached if line.user_id not in carts]).delete()
+    merged_users.update(carts)
+
+    # The merged carts have new lines, so their stored totals are stale
+    recompute_totals(Order.objects.filter(user_id__in=merged_users, ordered=False))
+
+
+def recompute_totals(orders):
+    # Same as OrderQuerySet.recompute_totals, which historical models don't have
+    rows = orders.annotate(
+        computed_subtotal=Coalesce(Sum(final_price_expression('items__')), Value(0.0)),
+        coupon_percentage=Coalesce(F('coupon__percentage'), Value(0.0)),
+    ).values_list('pk', 'computed_subtotal', 'coupon_percentage')
+    for pk, subtotal, percentage in rows:
+        discount = subtotal * (percentage/100)
+        orders.model.objects.filter(pk=pk).update(subtotal=subtotal, discount=discount, total=subtotal - discount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_order_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='unique_open_order'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user', 'item'), name='unique_open_order_item'),
+        ),
+    ]
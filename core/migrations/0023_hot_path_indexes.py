@@ -0,0 +1,68 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:37
+
+import random
+import string
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate_codes(apps, schema_editor):
+    Coupon = apps.get_model('core', 'Coupon')
+    Order = apps.get_model('core', 'Order')
+
+    # The oldest coupon keeps a duplicated code; the others get their pk
+    # appended, so orders still point at the coupon they used
+    duplicated = (Coupon.objects.values('code').annotate(coupons=Count('pk'))
+                  .filter(coupons__gt=1).values_list('code', flat=True))
+    for code in duplicated:
+        for coupon in Coupon.objects.filter(code=code).order_by('pk')[1:]:
+            suffix = f'-{coupon.pk}'
+            coupon.code = code[:50 - len(suffix)] + suffix
+            coupon.save(update_fields=['code'])
+
+    # Blank ref codes mean "not placed yet", which NULL says without clashing
+    Order.objects.filter(ref_code='').update(ref_code=None)
+    duplicated = (Order.objects.exclude(ref_code=None).values('ref_code').annotate(orders=Count('pk'))
+                  .filter(orders__gt=1).values_list('ref_code', flat=True))
+    for ref_code in duplicated:
+        for order in Order.objects.filter(ref_code=ref_code).order_by('pk')[1:]:
+            while True:
+                new_code = ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+                if not Order.objects.filter(ref_code=new_code).exists():
+                    break
+            order.ref_code = new_code
+            order.save(update_fields=['ref_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_unique_open_cart'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['user', 'address_type', 'default'], name='address_user_type_default_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'ordered'], name='order_user_ordered_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['user', 'item', 'ordered'], name='orderitem_user_item_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eyelenses',
+            name='processed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
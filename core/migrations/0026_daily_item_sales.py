@@ -0,0 +1,41 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_modified_timestamps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyItemSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('category', models.CharField(choices=[('FS', 'Full Sheet Frame'), ('FM', 'Full Metal Frame'), ('3P', 'Without Frame'), ('SP', 'Half Frame')], max_length=2)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('gross', models.FloatField(default=0)),
+                ('discount', models.FloatField(default=0)),
+                ('revenue', models.FloatField(default=0)),
+                ('refunded_units', models.PositiveIntegerField(default=0)),
+                ('refunded_amount', models.FloatField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='core.Item')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily item sales',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dailyitemsales',
+            index=models.Index(fields=['date', 'category'], name='dailysales_date_category_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemsales',
+            constraint=models.UniqueConstraint(fields=('date', 'item'), name='unique_daily_item_sales'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.14 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_daily_item_sales'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered', 'order_date'], name='order_ordered_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(refund_request=True), fields=['order_date'], name='order_refund_request_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(failed_confirm=True), fields=['order_date'], name='order_failed_confirm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(in_process_delivery=True), fields=['order_date'], name='order_in_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('delivered', False), ('ordered', True)), fields=['order_date'], name='order_undelivered_idx'),
+        ),
+    ]
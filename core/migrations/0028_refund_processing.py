@@ -0,0 +1,54 @@
+# Generated by Django 2.2.14 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+def mark_granted_refunds(apps, schema_editor):
+    # Refunds granted before there was a processing step count as done
+    Refund = apps.get_model('core', 'Refund')
+    Refund.objects.filter(order__refund_granted=True).update(status='D', accepted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_order_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='refunded',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='processed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='processor_reference',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='status',
+            field=models.CharField(choices=[('R', 'Requested'), ('Q', 'Queued'), ('D', 'Refunded'), ('F', 'Failed')], default='R', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='refund',
+            index=models.Index(fields=['status'], name='refund_status_idx'),
+        ),
+        migrations.RunPython(mark_granted_refunds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.14 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_refund_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='granted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
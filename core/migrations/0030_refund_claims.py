@@ -0,0 +1,23 @@
+# Generated by Django 2.2.14 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_refund_granted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refund',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='refund',
+            name='status',
+            field=models.CharField(choices=[('R', 'Requested'), ('Q', 'Queued'), ('P', 'Processing'), ('D', 'Refunded'), ('F', 'Failed')], default='R', max_length=1),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import Case, Count, ExpressionWrapper, F, Prefetch, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.shortcuts import reverse
+from django.utils import timezone
 from django_countries.fields import CountryField
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models.signals import pre_delete
@@ -37,6 +40,14 @@ ADDRESS_CHOICES = (
     ('S', "Shipping"),
 )
 
+REFUND_STATUS_CHOICES = (
+    ('R', "Requested"),
+    ('Q', "Queued"),
+    ('P', "Processing"),
+    ('D', "Refunded"),
+    ('F', "Failed"),
+)
+
 
 # Create your models here.
 class Item(models.Model):
@@ -50,6 +61,7 @@ class Item(models.Model):
     features = models.TextField(default="This is a description of the product.")
     fview = models.ImageField(upload_to="media/Item/", blank=True, null=True)
     sview = models.ImageField(upload_to="media/Item/", blank=True, null=True)
+    modified = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return str(self.title)
@@ -77,6 +89,14 @@ class OrderItem(models.Model):
     lenses_required = models.BooleanField(default=False)
     lenses = models.ForeignKey('EyeLenses', on_delete=models.SET_NULL, blank=True, null=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item'], condition=Q(ordered=False), name='unique_open_order_item'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'item', 'ordered'], name='orderitem_user_item_idx'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
@@ -84,6 +104,8 @@ class OrderItem(models.Model):
         return self.quantity * self.item.price
         
     def get_total_discount_item_price(self):
+        if self.item.discount_price is None:
+            return 0
         return self.quantity * self.item.discount_price
         
     def get_amount_saved(self):
@@ -95,9 +117,46 @@ class OrderItem(models.Model):
         else:
             return self.get_total_item_price()        
 
+def final_price_expression(prefix=''):
+    # Database-side equivalent of OrderItem.get_final_price()
+    no_discount = (Q(**{prefix + 'item__discount_price__isnull': True}) |
+                   Q(**{prefix + 'item__discount_price': 0}))
+    return ExpressionWrapper(
+        F(prefix + 'quantity') * Case(
+            When(no_discount, then=F(prefix + 'item__price')),
+            default=F(prefix + 'item__discount_price'),
+        ),
+        output_field=models.FloatField(),
+    )
+
+class OrderQuerySet(models.QuerySet):
+    def with_lines(self):
+        # Everything the cart and order history templates touch, in three queries
+        return self.select_related('coupon').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('item', 'lenses').order_by('pk'))
+        )
+
+    def with_computed_totals(self):
+        return self.annotate(
+            computed_subtotal=Coalesce(Sum(final_price_expression('items__')), Value(0.0)),
+            coupon_percentage=Coalesce(F('coupon__percentage'), Value(0.0)),
+            line_count=Count('items'),
+        )
+
+    def recompute_totals(self):
+        # One aggregate query for all the orders, then an UPDATE per order.
+        # Filters on items__ would narrow the Sum, so aggregate over the pks.
+        orders = self.model.objects.filter(pk__in=self.order_by().values('pk'))
+        rows = orders.with_computed_totals().values_list('pk', 'computed_subtotal', 'coupon_percentage')
+        for pk, subtotal, percentage in rows:
+            self.model.objects.filter(pk=pk).update(
+                modified=timezone.now(),
+                **self.model.calculate_totals(subtotal, percentage)
+            )
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    ref_code = models.CharField(max_length=20, blank=True, null=True)
+    ref_code = models.CharField(max_length=20, blank=True, null=True, unique=True)
     ordered = models.BooleanField(default=False)
     items = models.ManyToManyField(OrderItem)
     start_date = models.DateTimeField(auto_now_add=True)
@@ -115,22 +174,62 @@ class Order(models.Model):
     refund_request = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
     payment = models.ForeignKey('Payment', on_delete=models.SET_NULL, null=True, blank=True)
+
+    # Kept up to date by update_totals() whenever the lines or the coupon change
+    subtotal = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    total = models.FloatField(default=0)
+    # Bumped by save() only; queryset updates leave it alone, so every
+    # .update() that changes what the order shows must set it too. The API
+    # derives its ETag / Last-Modified from it
+    modified = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user'], condition=Q(ordered=False), name='unique_open_order'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'ordered'], name='order_user_ordered_idx'),
+            # Admin changelist: its ordering and date hierarchy, and partial
+            # indexes for the flags that only a few orders have set
+            models.Index(fields=['ordered', 'order_date'], name='order_ordered_date_idx'),
+            models.Index(fields=['order_date'], condition=Q(refund_request=True), name='order_refund_request_idx'),
+            models.Index(fields=['order_date'], condition=Q(failed_confirm=True), name='order_failed_confirm_idx'),
+            models.Index(fields=['order_date'], condition=Q(in_process_delivery=True), name='order_in_delivery_idx'),
+            models.Index(fields=['order_date'], condition=Q(ordered=True, delivered=False), name='order_undelivered_idx'),
+        ]
+
     def __str__(self):
         return str(self.user.username)
 
+    @staticmethod
+    def calculate_totals(subtotal, percentage):
+        discount = subtotal * (percentage/100)
+        return {
+            'subtotal': subtotal,
+            'discount': discount,
+            'total': subtotal - discount,
+        }
+
+    def update_totals(self):
+        row = (Order.objects.filter(pk=self.pk)
+               .with_computed_totals()
+               .values('computed_subtotal', 'coupon_percentage', 'line_count')
+               .get())
+        totals = Order.calculate_totals(row['computed_subtotal'], row['coupon_percentage'])
+        totals['modified'] = timezone.now()
+        Order.objects.filter(pk=self.pk).update(**totals)
+        for field, value in totals.items():
+            setattr(self, field, value)
+        return row['line_count']
+
     def get_total_bill_amount(self):
-        total_amount = 0
-        for item in self.items.all():
-            total_amount += item.get_final_price()
-        return total_amount
+        return self.subtotal
         
     def get_total_bill_amount_with_discount(self):
-        total_amount = 0
-        for item in self.items.all():
-            total_amount += item.get_final_price()
-        if self.coupon:
-            total_amount -= total_amount * (self.coupon.percentage/100)
-        return total_amount
+        return self.total
 
 class Address(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -144,6 +243,9 @@ class Address(models.Model):
 
     class Meta:
         verbose_name_plural = 'Addresses'
+        indexes = [
+            models.Index(fields=['user', 'address_type', 'default'], name='address_user_type_default_idx'),
+        ]
 
     def __str__(self):
         return self.user.username
@@ -153,11 +255,12 @@ class Payment(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
     time_stamp = models.DateTimeField(auto_now_add=True)
     amount = models.FloatField()
+    refunded = models.BooleanField(default=False)
     def __str__(self):
         return f"$ {self.amount} bill of {self.user.username}"
 
 class Coupon(models.Model):
-    code = models.CharField(max_length=50)
+    code = models.CharField(max_length=50, unique=True)
     percentage = models.FloatField(default=0)
     def __str__(self):
         return self.code
@@ -167,6 +270,24 @@ class Refund(models.Model):
     email = models.EmailField()
     message = models.TextField()
     accepted = models.BooleanField(default=False)
+
+    # Set by core.refunds as the refund goes through the payment processor
+    status = models.CharField(max_length=1, choices=REFUND_STATUS_CHOICES, default='R')
+    processor_reference = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # When a run last took the refund off the queue to send it
+    claimed = models.DateTimeField(blank=True, null=True)
+    processed = models.DateTimeField(blank=True, null=True)
+    # Set on the refund that granted the order's refund; the sales rollups
+    # count the refunded lines on this day
+    granted = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status'], name='refund_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.pk}"
 
@@ -182,9 +303,61 @@ class EyeLenses(models.Model):
     power_type = models.CharField(blank=True, null=True, max_length=1, choices=POWER_TYPES_CHOICES)
     lenses_type = models.CharField(blank=True, null=True, max_length=2, choices=LENSES_TYPES_CHOICES)
     prescription_image = models.ImageField(upload_to = "user_prescription/", blank=True, null=True)
+    # Set once the upload has been re-encoded by uploads.process_prescription
+    processed = models.BooleanField(default=False)
     date = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
     def __str__(self):
         return self.user.username
 
+
+class SearchDocument(models.Model):
+    item = models.OneToOneField(Item, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    length = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.item_id)
+
+class SearchTerm(models.Model):
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=64, db_index=True)
+    frequency = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('term', 'document')
+
+    def __str__(self):
+        return self.term
+
+
+class DailyItemSales(models.Model):
+    """
+    Sales per item per day, kept up to date by core.reports as orders are paid
+    and refunded, so reports never have to scan the order tables.
+    """
+    date = models.DateField()
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='daily_sales')
+    # Copied from the item so reports can group by category without a join
+    category = models.CharField(max_length=2, choices=CATEGORIES_CHOICES)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    # List price of the units sold, the discount given on it (item discount
+    # plus the line's share of any coupon) and what was actually charged
+    gross = models.FloatField(default=0)
+    discount = models.FloatField(default=0)
+    revenue = models.FloatField(default=0)
+    refunded_units = models.PositiveIntegerField(default=0)
+    refunded_amount = models.FloatField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Daily item sales'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'item'], name='unique_daily_item_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'category'], name='dailysales_date_category_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.item_id}'
@@ -0,0 +1,133 @@
+import json
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+
+from . import caching
+
+# Below this many rows an exact COUNT(*) is cheap enough to run
+EXACT_COUNT_LIMIT = 10000
+
+
+def planner_estimate(queryset):
+    """
+    PostgreSQL's estimate of how many rows the queryset returns: the table's
+    reltuples when it is unfiltered, otherwise the row estimate of its plan.
+    None on other databases.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] > 0 else None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def estimated_count(queryset):
+    """
+    Row count for display: the planner's estimate for large results,
+    otherwise an exact COUNT(*).
+    """
+    estimate = planner_estimate(queryset)
+    if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+        return estimate
+    return queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over large tables; see estimated_count.
+    """
+
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class KeysetPage:
+    def __init__(self, paginator, object_list, cursor, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getstate__(self):
+        # Pages are cached; the paginator holds an unpicklable queryset
+        state = self.__dict__.copy()
+        state['paginator'] = None
+        return state
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].pk if self._has_next else None
+
+    @property
+    def previous_cursor(self):
+        return self.object_list[0].pk if self._has_previous else None
+
+
+class KeysetPaginator:
+    """
+    Pages a queryset newest-first by primary key. Instead of OFFSET and a
+    COUNT(*), each page asks for the rows after (or before) the last primary
+    key seen, so every page costs one indexed query however deep it is.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset.order_by()
+        self.per_page = per_page
+
+    def page(self, after=None, before=None):
+        if before is not None:
+            rows = list(self.queryset.filter(pk__gt=before).order_by('pk')[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(self, rows, f'before-{before}', has_next=bool(rows), has_previous=has_previous)
+
+        queryset = self.queryset.order_by('-pk')
+        if after is not None:
+            queryset = queryset.filter(pk__lt=after)
+        rows = list(queryset[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        cursor = f'after-{after}' if after is not None else 'first'
+        return KeysetPage(self, rows[:self.per_page], cursor, has_next=has_next, has_previous=after is not None)
+
+    def estimated_count(self):
+        """
+        Cheap row count for display. Uses the planner's estimate on PostgreSQL
+        when the queryset is unfiltered, otherwise a COUNT(*) cached until the
+        catalog changes.
+        """
+        model = self.queryset.model
+        if not self.queryset.query.where:
+            estimate = planner_estimate(self.queryset)
+            if estimate is not None:
+                return estimate
+        key = caching.catalog_key('count', model._meta.label_lower, str(self.queryset.query))
+        return cache.get_or_set(key, self.queryset.count, caching.CATALOG_TIMEOUT)
@@ -0,0 +1,183 @@
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import reports
+from .models import Order, Payment, Refund
+
+# Granted refunds are queued, then sent to the payment processor a chunk at a
+# time. A chunk is claimed in a short transaction that marks it processing,
+# the processor is called outside any transaction, and the results are
+# written back to Refund, Payment and Order in one transaction so the three
+# always agree. Processor calls carry an idempotency key made from the Refund
+# pk: a refund left processing by a run that died is claimed again after
+# REFUND_CLAIM_TIMEOUT, and repeating its call refunds no one twice.
+
+CHUNK_SIZE = 50
+
+
+class RefundError(Exception):
+    # The processor declined the refund; it is marked failed and can be queued again
+    pass
+
+
+class LocalRefundClient:
+    """
+    Stands in for the payment processor in development and tests. Refunds
+    are only remembered, by idempotency key like the real ones.
+    """
+
+    def __init__(self):
+        self.refunds = {}
+
+    def refund(self, payment, idempotency_key):
+        return self.refunds.setdefault(idempotency_key, f'local-{idempotency_key}')
+
+
+class StripeRefundClient:
+    def refund(self, payment, idempotency_key):
+        try:
+            refund = stripe.Refund.create(
+                charge=payment.transaction_id,
+                idempotency_key=idempotency_key,
+                api_key=settings.STRIPE_SECRET_KEY,
+            )
+        except stripe.error.StripeError as e:
+            raise RefundError(e.user_message or str(e))
+        return refund.id
+
+
+def get_client():
+    return import_string(settings.REFUND_CLIENT)()
+
+
+def queue(refunds):
+    # Only requested and failed refunds; returns how many were queued
+    return refunds.filter(status__in=['R', 'F']).update(status='Q', error='')
+
+
+def requeue_processing():
+    """
+    Queues refunds left processing without waiting for REFUND_CLAIM_TIMEOUT.
+    Only safe while no other run is going. Returns how many were queued.
+    """
+    return Refund.objects.filter(status='P').update(status='Q')
+
+
+def queue_orders(orders):
+    """
+    Queues the refunds of orders that haven't been refunded yet, creating a
+    Refund for orders granted without a customer request.
+    """
+    orders = orders.filter(ordered=True, refund_granted=False)
+    unrequested = orders.exclude(refund__status__in=['R', 'Q', 'P', 'F']).select_related('user')
+    created = Refund.objects.bulk_create([
+        Refund(order=order, email=order.user.email, message='Granted from the admin', status='Q')
+        for order in unrequested
+    ])
+    return len(created) + queue(Refund.objects.filter(order__in=orders))
+
+
+def claim(chunk_size=CHUNK_SIZE):
+    """
+    Marks up to chunk_size queued refunds, and refunds left processing for
+    longer than REFUND_CLAIM_TIMEOUT, as processing. Returns them with their
+    order's payment.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.REFUND_CLAIM_TIMEOUT)
+    with transaction.atomic():
+        # skip_locked lets several runs share the queue
+        pks = list(Refund.objects
+                   .filter(Q(status='Q') | Q(status='P', claimed__lt=stale))
+                   .select_for_update(skip_locked=True)
+                   .order_by('pk')
+                   .values_list('pk', flat=True)[:chunk_size])
+        Refund.objects.filter(pk__in=pks).update(status='P', claimed=now, attempts=F('attempts') + 1)
+    return list(Refund.objects.filter(pk__in=pks).select_related('order__payment').order_by('pk'))
+
+
+def record(refunded, failed, paid):
+    """
+    Writes the processor's answers back to the refunds, their payments and
+    orders, and takes newly refunded orders off the sales rollups.
+    """
+    now = timezone.now()
+    for refund in refunded:
+        refund.status, refund.accepted, refund.error, refund.processed = 'D', True, '', now
+    for refund in failed:
+        refund.status = 'F'
+
+    with transaction.atomic():
+        # Locked so two runs finishing refunds of the same order grant it once
+        granted = list(Order.objects.with_lines()
+                       .select_for_update(of=('self',))
+                       .filter(pk__in={refund.order_id for refund in refunded}, refund_granted=False))
+        granting = {}
+        for refund in refunded:
+            granting.setdefault(refund.order_id, refund)
+        for order in granted:
+            granting[order.pk].granted = now
+
+        Refund.objects.bulk_update(refunded + failed, ['status', 'accepted', 'processor_reference', 'error',
+                                                       'processed', 'granted'])
+        Payment.objects.filter(pk__in=paid).update(refunded=True)
+        Order.objects.filter(pk__in=[order.pk for order in granted]).update(
+            refund_request=False, refund_granted=True, modified=now,
+        )
+        for order in granted:
+            reports.record_refund(order, timezone.localdate(now))
+
+
+def process_chunk(client, chunk_size=CHUNK_SIZE):
+    """
+    Refunds up to chunk_size queued refunds. Returns (refunded, failed), or
+    None once nothing is queued.
+    """
+    chunk = claim(chunk_size)
+    if not chunk:
+        return None
+
+    refunded, failed, paid = [], [], set()
+    try:
+        for refund in chunk:
+            payment = refund.order.payment
+            try:
+                if payment is None:
+                    raise RefundError('The order has no payment to refund')
+                # A second request for an order that is already refunded
+                # just closes; its reference stays blank
+                if not payment.refunded and payment.pk not in paid:
+                    refund.processor_reference = client.refund(payment, f'refund-{refund.pk}')
+            except RefundError as e:
+                refund.error = str(e)
+                failed.append(refund)
+                continue
+            paid.add(payment.pk)
+            refunded.append(refund)
+    finally:
+        # Keep what the processor already did if it stops answering part way;
+        # the rest of the chunk stays processing until it is claimed again
+        if refunded or failed:
+            record(refunded, failed, paid)
+    return len(refunded), len(failed)
+
+
+def process_refunds(chunk_size=CHUNK_SIZE, client=None):
+    """
+    Works through the queue a chunk at a time until it is empty.
+    Returns (refunded, failed).
+    """
+    client = client or get_client()
+    refunded = failed = 0
+    while True:
+        result = process_chunk(client, chunk_size)
+        if result is None:
+            return refunded, failed
+        refunded += result[0]
+        failed += result[1]
@@ -0,0 +1,159 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, Exists, F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .models import DailyItemSales, Order, Refund
+
+COUNTERS = ('orders', 'units', 'gross', 'discount', 'revenue', 'refunded_units', 'refunded_amount')
+
+# DailyItemSales rows are only ever added to: a payment adds the order's
+# lines to today's rows and a granted refund adds them to the refund day's
+# refunded_* columns. rebuild() recomputes them from the orders.
+
+
+def line_amounts(order):
+    """
+    Yields (item, units, gross, discount, revenue) for each line of a paid
+    order. The coupon discount is shared between the lines in proportion to
+    what each line cost.
+    """
+    for line in order.items.all():
+        charged = line.get_final_price()
+        coupon_share = order.discount * charged / order.subtotal if order.subtotal else 0
+        gross = line.get_total_item_price()
+        revenue = charged - coupon_share
+        yield line.item, line.quantity, gross, gross - revenue, revenue
+
+
+def sale_rows(order):
+    rows = {}
+    for item, units, gross, discount, revenue in line_amounts(order):
+        rows[item.pk] = {
+            'category': item.category, 'orders': 1, 'units': units,
+            'gross': gross, 'discount': discount, 'revenue': revenue,
+        }
+    return rows
+
+
+def refund_rows(order):
+    rows = {}
+    for item, units, gross, discount, revenue in line_amounts(order):
+        rows[item.pk] = {'category': item.category, 'refunded_units': units, 'refunded_amount': revenue}
+    return rows
+
+
+def add(day, rows):
+    """
+    Adds the counters in rows ({item_id: {counter: amount}}) to the day's
+    rollups, creating the rows that don't exist yet.
+    """
+    for item_id, values in rows.items():
+        increments = {name: F(name) + values[name] for name in COUNTERS if values.get(name)}
+        rollup = DailyItemSales.objects.filter(date=day, item_id=item_id)
+        if rollup.update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                DailyItemSales.objects.create(date=day, item_id=item_id, **values)
+        except IntegrityError:
+            # Created by a concurrent request since the update
+            rollup.update(**increments)
+
+
+def _with_lines(order):
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        return order
+    return Order.objects.with_lines().get(pk=order.pk)
+
+
+def record_sale(order, day=None):
+    add(day or timezone.localdate(), sale_rows(_with_lines(order)))
+
+
+def record_refund(order, day=None):
+    add(day or timezone.localdate(), refund_rows(_with_lines(order)))
+
+
+def in_chunks(queryset, size=1000):
+    """
+    Yields the orders in the queryset as lists of size with their lines
+    prefetched. Each chunk starts after the last primary key of the one
+    before, so memory stays flat however many orders there are.
+    """
+    orders = queryset.with_lines().order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(orders.filter(pk__gt=last_pk)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def sale_day(order):
+    paid_at = order.payment.time_stamp if order.payment_id else order.order_date
+    return timezone.localdate(paid_at)
+
+
+def undated_refunds():
+    """
+    Orders whose refund was granted before grant times were recorded (or
+    without going through core.refunds). There is no day to count their
+    refunds on, so rebuild() leaves them out of the rollups.
+    """
+    dated = Refund.objects.filter(order=OuterRef('pk'), granted__isnull=False)
+    return (Order.objects.filter(ordered=True, refund_granted=True)
+            .annotate(dated=Exists(dated)).filter(dated=False))
+
+
+def rebuild(since=None, chunk_size=1000):
+    """
+    Recomputes the rollups from the orders, for every day or from since
+    onwards. Refunds are counted on the day they were granted, as
+    record_refund does; see undated_refunds() for the ones that are skipped.
+    Returns the number of rollup rows written.
+    """
+    totals = defaultdict(lambda: defaultdict(float))
+    categories = {}
+
+    sales = Order.objects.filter(ordered=True).select_related('payment')
+    granted = (Refund.objects.filter(order=OuterRef('pk'), granted__isnull=False)
+               .order_by('granted').values('granted')[:1])
+    refunds = (Order.objects.filter(ordered=True, refund_granted=True)
+               .annotate(granted=Subquery(granted, output_field=DateTimeField()))
+               .filter(granted__isnull=False))
+    if since is not None:
+        sales = sales.filter(Q(payment__time_stamp__date__gte=since) |
+                             Q(payment=None, order_date__date__gte=since))
+        refunds = refunds.filter(granted__date__gte=since)
+
+    for orders in in_chunks(sales, chunk_size):
+        for order in orders:
+            day = sale_day(order)
+            for item_id, values in sale_rows(order).items():
+                categories[item_id] = values.pop('category')
+                for name, amount in values.items():
+                    totals[day, item_id][name] += amount
+    for orders in in_chunks(refunds, chunk_size):
+        for order in orders:
+            day = timezone.localdate(order.granted)
+            for item_id, values in refund_rows(order).items():
+                categories[item_id] = values.pop('category')
+                for name, amount in values.items():
+                    totals[day, item_id][name] += amount
+
+    rollups = [
+        DailyItemSales(date=day, item_id=item_id, category=categories[item_id],
+                       **{name: int(amount) if name in ('orders', 'units', 'refunded_units') else amount
+                          for name, amount in values.items()})
+        for (day, item_id), values in totals.items()
+    ]
+    with transaction.atomic():
+        existing = DailyItemSales.objects.all()
+        if since is not None:
+            existing = existing.filter(date__gte=since)
+        existing.delete()
+        DailyItemSales.objects.bulk_create(rollups)
+    return len(rollups)
@@ -0,0 +1,178 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count
+from django.utils.html import strip_tags
+
+from .models import Item, SearchDocument, SearchTerm
+
+# Okapi BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Title words count three times so a match in the title outranks the same
+# word buried in the description.
+FIELD_WEIGHTS = (
+    ('title', 3),
+    ('description', 1),
+    ('features', 1),
+)
+
+# The last word of a query is matched as a prefix ("glas" -> "glass", "glasses")
+# but only against this many index terms.
+MAX_PREFIX_EXPANSIONS = 20
+MIN_PREFIX_LENGTH = 2
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+
+# Document count and average length for BM25, cached until the index changes
+STATS_KEY = 'search-stats'
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with',
+))
+
+
+def tokenize(text):
+    tokens = TOKEN_RE.findall(strip_tags(text or '').lower())
+    return [t for t in tokens if t not in STOP_WORDS and len(t) <= MAX_TERM_LENGTH]
+
+
+def document_terms(item):
+    counts = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(getattr(item, field)):
+            counts[token] += weight
+    return counts
+
+
+def index_items(items):
+    items = list(items)
+    if not items:
+        return
+    documents = []
+    terms = []
+    for item in items:
+        counts = document_terms(item)
+        documents.append(SearchDocument(item_id=item.pk, length=sum(counts.values())))
+        terms.extend(
+            SearchTerm(document_id=item.pk, term=term, frequency=frequency)
+            for term, frequency in counts.items()
+        )
+    with transaction.atomic():
+        # Deleting the documents cascades to their terms
+        SearchDocument.objects.filter(pk__in=[item.pk for item in items]).delete()
+        SearchDocument.objects.bulk_create(documents)
+        SearchTerm.objects.bulk_create(terms, batch_size=500)
+    invalidate_stats()
+
+
+def index_item(item):
+    index_items([item])
+
+
+def remove_item(item):
+    SearchDocument.objects.filter(pk=item.pk).delete()
+    invalidate_stats()
+
+
+def invalidate_stats():
+    # Again on commit, in case a search cached the old stats in between
+    cache.delete(STATS_KEY)
+    transaction.on_commit(lambda: cache.delete(STATS_KEY))
+
+
+def index_stats():
+    """
+    Returns (number of documents, average document length).
+    """
+    stats = cache.get(STATS_KEY)
+    if stats is None:
+        row = SearchDocument.objects.aggregate(total=Count('pk'), avg_length=Avg('length'))
+        stats = (row['total'], row['avg_length'] or 1)
+        cache.set(STATS_KEY, stats, None)
+    return stats
+
+
+def query_terms(query):
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    terms = set(tokens)
+    last = tokens[-1]
+    if len(last) >= MIN_PREFIX_LENGTH:
+        expansions = (SearchTerm.objects
+                      .filter(term__startswith=last)
+                      .values_list('term', flat=True)
+                      .distinct()[:MAX_PREFIX_EXPANSIONS])
+        terms.update(expansions)
+    return list(terms)
+
+
+def rank(query, limit=None):
+    """
+    Returns a list of (item_id, score) pairs for the query, best match first.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    total, avg_length = index_stats()
+    if not total:
+        return []
+
+    document_frequency = dict(SearchTerm.objects
+                              .filter(term__in=terms)
+                              .order_by()
+                              .values('term')
+                              .annotate(documents=Count('pk'))
+                              .values_list('term', 'documents'))
+    if not document_frequency:
+        return []
+
+    # Very common words can match most of the catalog; keep each term's
+    # strongest postings so one request never pulls more than
+    # SEARCH_MAX_POSTINGS rows, and a rare term keeps its share.
+    per_term = max(1, settings.SEARCH_MAX_POSTINGS // len(document_frequency))
+    postings = {
+        term: (SearchTerm.objects
+               .filter(term=term)
+               .order_by('-frequency', 'document_id')
+               .values_list('document_id', 'frequency', 'document__length')[:per_term])
+        for term in document_frequency
+    }
+
+    scores = defaultdict(float)
+    for term, matches in postings.items():
+        documents = document_frequency[term]
+        idf = math.log(1 + (total - documents + 0.5) / (documents + 0.5))
+        for document_id, frequency, length in matches:
+            norm = K1 * (1 - B + B * length / avg_length)
+            scores[document_id] += idf * frequency * (K1 + 1) / (frequency + norm)
+
+    ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))
+    if limit is not None:
+        ranked = ranked[:limit]
+    return ranked
+
+
+def load_items(ids):
+    """
+    Fetches the Items for the given ids, keeping the order of the ids.
+    """
+    ids = list(ids)
+    items = Item.objects.in_bulk(ids)
+    return [items[item_id] for item_id in ids if item_id in items]
+
+
+def search(query, limit=None):
+    """
+    Returns the Items matching the query ordered by relevance.
+    """
+    return load_items(item_id for item_id, score in rank(query, limit))
@@ -0,0 +1,126 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import caching, cart, images, search
+from .models import Coupon, Item, Order, OrderItem
+
+
+@receiver(post_save, sender=Item)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    # Deleting an Item cascades to its SearchDocument and terms
+    if not raw:
+        search.index_item(instance)
+
+
+@receiver(post_delete, sender=Item)
+def invalidate_search_stats(sender, instance, **kwargs):
+    # The SearchDocument went with the Item by cascade
+    search.invalidate_stats()
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_catalog_cache(sender, instance, raw=False, **kwargs):
+    caching.bump_catalog_version()
+
+
+@receiver(pre_save, sender=Item)
+def remember_item_state(sender, instance, raw=False, **kwargs):
+    # A renamed slug still has the old page cached, and only new uploads
+    # need image variants
+    instance._previous_state = {}
+    if not raw and instance.pk:
+        instance._previous_state = Item.objects.filter(pk=instance.pk).values('slug', 'fview', 'sview').first() or {}
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_product_cache(sender, instance, **kwargs):
+    previous_slug = getattr(instance, '_previous_state', {}).get('slug')
+    if previous_slug:
+        caching.invalidate_product(instance, previous_slug)
+    else:
+        caching.invalidate_product(instance)
+
+
+@receiver(post_save, sender=Item)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', {})
+    for field in ('fview', 'sview'):
+        field_file = getattr(instance, field)
+        if field_file and field_file.name != previous.get(field):
+            images.generate_variants(field_file)
+        # The replaced image's variants, unless another Item still shows it
+        old_name = previous.get(field)
+        if (old_name and old_name != field_file.name
+                and not Item.objects.filter(Q(fview=old_name) | Q(sview=old_name)).exists()):
+            images.delete_variants(old_name)
+
+
+@receiver(post_save, sender=Item)
+def update_open_order_totals_for_item(sender, instance, created=False, raw=False, **kwargs):
+    # Paid orders keep the prices they were charged
+    if not raw and not created:
+        Order.objects.filter(ordered=False, items__item=instance).recompute_totals()
+
+
+@receiver(m2m_changed, sender=Order.items.through)
+def update_totals_for_cart_lines(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        if pk_set:
+            Order.objects.filter(pk__in=pk_set).recompute_totals()
+            for user_id in Order.objects.filter(pk__in=pk_set).values_list('user_id', flat=True):
+                caching.invalidate_cart_count(user_id)
+    else:
+        line_count = instance.update_totals()
+        if not instance.ordered:
+            caching.set_cart_count(instance.user_id, line_count)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_totals_for_quantity(sender, instance, created=False, raw=False, **kwargs):
+    # Paid orders keep the prices they were charged
+    if not raw and not created:
+        Order.objects.filter(ordered=False, items=instance).recompute_totals()
+
+
+@receiver(pre_delete, sender=OrderItem)
+def remember_orders_for_deleted_line(sender, instance, **kwargs):
+    # The m2m rows are gone by post_delete, so look the orders up first
+    instance._order_pks = list(Order.objects.filter(items=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_totals_for_deleted_line(sender, instance, **kwargs):
+    order_pks = getattr(instance, '_order_pks', None)
+    if order_pks:
+        Order.objects.filter(ordered=False, pk__in=order_pks).recompute_totals()
+        for user_id in Order.objects.filter(pk__in=order_pks).values_list('user_id', flat=True):
+            caching.invalidate_cart_count(user_id)
+
+
+@receiver(post_save, sender=Order)
+def update_totals_for_coupon(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Paid orders keep the totals they were charged
+    if raw or created or instance.ordered:
+        return
+    if update_fields is None or 'coupon' in update_fields:
+        instance.update_totals()
+
+
+@receiver(post_save, sender=Coupon)
+def update_open_order_totals_for_coupon(sender, instance, created=False, raw=False, **kwargs):
+    if not raw and not created:
+        Order.objects.filter(ordered=False, coupon=instance).recompute_totals()
+
+
+@receiver(user_logged_in)
+def merge_session_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        cart.merge_session_cart(request.session, user)
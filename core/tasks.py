@@ -0,0 +1,29 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Small in-process pool for work that shouldn't hold up the request/response
+# cycle. Anything submitted here must also be recoverable by a management
+# command, since queued work is lost if the process exits.
+executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_WORKERS, thread_name_prefix='background')
+
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', getattr(func, '__name__', func))
+    finally:
+        close_old_connections()
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Runs func in the background once the current transaction commits.
+    """
+    transaction.on_commit(lambda: executor.submit(_run, func, args, kwargs))
@@ -0,0 +1,21 @@
+from django import template
+from core import images
+
+register = template.Library()
+
+CARD_SIZES = "(min-width: 992px) 25vw, (min-width: 576px) 50vw, 100vw"
+
+@register.filter
+def variant_url(field_file, variant):
+    return images.variant_url(field_file, variant, 'jpg')
+
+@register.inclusion_tag('picture_snippet.html')
+def picture(field_file, alt='', css_class='', sizes=CARD_SIZES):
+    return {
+        'webp_srcset': images.srcset(field_file, 'webp') if field_file else '',
+        'jpg_srcset': images.srcset(field_file, 'jpg') if field_file else '',
+        'src': images.variant_url(field_file, 'card', 'jpg'),
+        'sizes': sizes,
+        'alt': alt,
+        'css_class': css_class,
+    }
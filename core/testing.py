@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+from .middleware import QueryRecorder
+
+
+def describe(queries):
+    return '\n'.join(f'{number}. {sql}' for number, sql in enumerate(queries, 1))
+
+
+class QueryBudgetMixin:
+    """
+    Assertions for TestCase subclasses that keep views within a query budget.
+    Responses from core views carry the numbers recorded by
+    QueryCountMiddleware; other code can be measured with assertMaxQueries.
+    """
+
+    def assertQueryBudget(self, response, max_queries, max_duplicates=0):
+        stats = getattr(response, 'query_stats', None)
+        if stats is None:
+            self.fail('Response has no query_stats; is QueryCountMiddleware installed '
+                      'and was the response served by a core view?')
+        if stats.count > max_queries:
+            self.fail(f'{stats.view} ran {stats.count} queries, budget is {max_queries}:\n'
+                      f'{describe(stats.queries)}')
+        duplicates = sum(stats.duplicates.values()) - len(stats.duplicates)
+        if duplicates > max_duplicates:
+            self.fail(f'{stats.view} repeated {duplicates} queries, budget is {max_duplicates}:\n'
+                      f'{describe(f"{sql} (x{times})" for sql, times in stats.duplicates.items())}')
+
+    @contextmanager
+    def assertMaxQueries(self, max_queries):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            yield recorder
+        if recorder.count > max_queries:
+            self.fail(f'{recorder.count} queries run, budget is {max_queries}:\n'
+                      f'{describe(sql for sql, duration in recorder.queries)}')
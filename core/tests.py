@@ -1,3 +1,1193 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from . import benchmarks, caching, cart, exports, images, middleware, refunds, reports, search, uploads, views
+from .models import Address, Coupon, DailyItemSales, EyeLenses, Item, Order, OrderItem, Payment, Refund, UserProfile
+from .testing import QueryBudgetMixin
+
+
+def create_items(count, start=0):
+    return [
+        Item.objects.create(title=f'Round Frame {n}', price=100 + n, slug=f'round-frame-{n}',
+                            category='FS', label='P')
+        for n in range(start, start + count)
+    ]
+
+
+def create_completed_order(user, items):
+    order = Order.objects.create(user=user, ordered=True, order_date=timezone.now(),
+                                 ref_code=f'ref{Order.objects.count():017d}')
+    order.items.add(*[OrderItem.objects.create(user=user, item=item, ordered=True) for item in items])
+    return order
+
+
+def image_upload(name='frame.jpg', size=(1200, 900), image_format='JPEG'):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'navy').save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class MediaRootMixin:
+    # Uploads and generated files go to a throwaway MEDIA_ROOT
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Each page must run the same number of queries however many lines or
+    orders it shows; a loop that queries per row fails these.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        UserProfile.objects.create(user=cls.user)
+        Address.objects.create(user=cls.user, street_address='1 Main Street', apartment_address='Flat 1',
+                               country='IN', zip_code='400001', address_type='S', default=True)
+        cls.items = create_items(12)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def fill_cart(self, lines):
+        for item in self.items[:lines]:
+            cart.add_item(self.user, item)
+        order = cart.get_open_order(self.user)
+        order.coupon = Coupon.objects.create(code=f'SAVE{lines}', percentage=10)
+        order.save()
+
+    def assertPageBudget(self, url, max_queries, grow, max_duplicates=0):
+        """
+        Requests url before and after grow() adds rows to the page and checks
+        both stay in budget with the same query count.
+        """
+        # Start both requests from a cold cache so they do the same work
+        cache.clear()
+        small = self.client.get(url)
+        self.assertEqual(small.status_code, 200)
+        self.assertQueryBudget(small, max_queries, max_duplicates)
+        grow()
+        cache.clear()
+        large = self.client.get(url)
+        self.assertEqual(large.status_code, 200)
+        self.assertQueryBudget(large, max_queries, max_duplicates)
+        self.assertEqual(small.query_stats.count, large.query_stats.count)
+
+    def test_home(self):
+        self.assertPageBudget(reverse('core:home'), 6, lambda: create_items(20, start=100))
+
+    def test_product_detail(self):
+        response = self.client.get(self.items[0].get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget(response, 6)
+
+    def test_order_summary(self):
+        self.fill_cart(2)
+        self.assertPageBudget(reverse('core:order-summary'), 6, lambda: self.fill_cart(10))
+
+    def test_checkout(self):
+        self.fill_cart(2)
+        self.assertPageBudget(reverse('core:checkout'), 7, lambda: self.fill_cart(10))
+
+    def test_user_profile(self):
+        create_completed_order(self.user, self.items[:2])
+        self.assertPageBudget(reverse('core:user_profile'), 6, lambda: [
+            create_completed_order(self.user, self.items[:5]) for _ in range(5)
+        ])
+
+    def test_search(self):
+        url = reverse('core:search') + '?query=round+frame'
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['results']), 10)
+        # The ranking reads each term's postings with the same query, so one
+        # repeat per extra query term; none for more matching items
+        self.assertPageBudget(url, 10, lambda: create_items(20, start=100), max_duplicates=1)
+
+    def test_api_order_summary(self):
+        self.fill_cart(2)
+        self.assertPageBudget(reverse('core:api:order_summary'), 6, lambda: self.fill_cart(10))
+
+    def test_api_user_profile(self):
+        create_completed_order(self.user, self.items[:2])
+        self.assertPageBudget(reverse('core:api:user_profile'), 6, lambda: [
+            create_completed_order(self.user, self.items[:5]) for _ in range(5)
+        ])
+
+    def test_api_catalog(self):
+        response = self.client.get(reverse('core:api:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget(response, 4)
+
+
+class QueryCountMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_items(3)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(DEBUG=True)
+    def test_logs_and_reports_the_repeated_queries(self):
+        # Ranking reads each term's postings with the same statement
+        with self.assertLogs('core.performance', 'INFO') as logs:
+            response = self.client.get(reverse('core:search'), {'query': 'round frame'})
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'core.views.Search')
+        [duplicate] = record['top_duplicates']
+        self.assertEqual(duplicate['times'], 2)
+        self.assertIn('core_searchterm', duplicate['sql'])
+        self.assertEqual(duplicate['id'], middleware.fingerprint_id(duplicate['sql']))
+        self.assertEqual(response['X-Duplicate-Queries'], '1')
+        self.assertEqual(response['X-Duplicate-Query-Fingerprints'], f'{duplicate["id"]}=2')
+
+    def test_fingerprints_stay_out_of_the_headers_without_debug(self):
+        response = self.client.get(reverse('core:search'), {'query': 'round frame'})
+        self.assertFalse(response.has_header('X-Duplicate-Query-Fingerprints'))
+        self.assertEqual(len(response.query_stats.top_duplicates()), 1)
+
+
+class CartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paid_order_keeps_its_totals(self):
+        order = create_completed_order(self.user, self.items[:2])
+        total = Order.objects.get(pk=order.pk).total
+        line = order.items.first()
+        line.quantity = 5
+        line.save()
+        order.items.last().delete()
+        self.assertEqual(Order.objects.get(pk=order.pk).total, total)
+
+    def test_cart_count_is_not_cached_on_rollback(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            cart.add_item(self.user, self.items[0])
+            raise RuntimeError
+        self.assertIsNone(cache.get(caching.cart_count_key(self.user.pk)))
+        self.assertEqual(caching.get_cart_count(self.user), 0)
+
+    def test_cart_count_cached_before_commit_is_dropped_on_commit(self):
+        key = caching.cart_count_key(self.user.pk)
+        with mock.patch.object(caching.transaction, 'on_commit') as on_commit:
+            caching.invalidate_cart_count(self.user.pk)
+        self.assertIsNone(cache.get(key))
+        # A concurrent request reads the count before the change commits
+        cache.set(key, 3)
+        on_commit.call_args[0][0]()
+        self.assertIsNone(cache.get(key))
+
+    def test_line_left_outside_the_cart_is_put_back(self):
+        # What the old remove-from-cart view and deleting a cart left behind
+        OrderItem.objects.create(user=self.user, item=self.items[0], quantity=1)
+        self.assertIsNone(cart.get_line(self.user, self.items[0]))
+        line, created = cart.add_item(self.user, self.items[0])
+        self.assertFalse(created)
+        order = cart.get_open_order(self.user)
+        self.assertEqual(list(order.items.all()), [line])
+        self.assertEqual(order.total, 200)
+        self.assertEqual(caching.get_cart_count(self.user), 1)
+        self.assertEqual(cart.get_line(self.user, self.items[0]).quantity, 2)
+
+    def test_session_cart_puts_back_a_line_left_outside_the_cart(self):
+        OrderItem.objects.create(user=self.user, item=self.items[0], quantity=1)
+        session = {cart.SESSION_KEY: {str(self.items[0].pk): 2, str(self.items[1].pk): 1}}
+        cart.merge_session_cart(session, self.user)
+        order = cart.get_open_order(self.user)
+        self.assertEqual(sorted(order.items.values_list('item_id', 'quantity')),
+                         [(self.items[0].pk, 3), (self.items[1].pk, 1)])
+        self.assertEqual(order.total, 401)
+
+    def test_open_order_created_by_a_concurrent_request_is_reused(self):
+        # The other request's cart is committed after this request looked
+        # for one; the unique constraint makes this request use it
+        other = Order.objects.create(user=self.user, order_date=timezone.now())
+        first = QuerySet.first
+        missed = []
+
+        def miss_once(queryset):
+            if not missed:
+                missed.append(queryset)
+                return None
+            return first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', miss_once):
+            line, created = cart.add_item(self.user, self.items[0])
+        self.assertTrue(missed)
+        self.assertEqual(list(Order.objects.filter(user=self.user, ordered=False)), [other])
+        self.assertEqual(list(other.items.all()), [line])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCartTests(TransactionTestCase):
+    """
+    Simultaneous add-to-cart clicks for one user. SQLite has no row locks
+    and fails concurrent writers outright, so this runs on PostgreSQL.
+    """
+
+    def test_concurrent_adds_share_one_cart(self):
+        user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        item, = create_items(1)
+        clicks = 8
+        barrier = threading.Barrier(clicks)
+        errors = []
+
+        def click():
+            try:
+                barrier.wait()
+                cart.add_item(user, item)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click) for _ in range(clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        order = Order.objects.get(user=user, ordered=False)
+        self.assertEqual([line.quantity for line in order.items.all()], [clicks])
+        self.assertEqual(order.total, clicks * item.price)
+
+
+class SessionCartMergeTests(TestCase):
+    """
+    Visitors fill a cart in their session; logging in moves it into their
+    open Order, adding to any cart they already had.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def add_anonymously(self, *items):
+        for item in items:
+            response = self.client.get(reverse('core:add_to_cart', args=[item.slug]))
+            self.assertEqual(response.status_code, 302)
+
+    def log_in(self):
+        response = self.client.post(reverse('account_login'), {'login': 'shopper', 'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+
+    def open_lines(self):
+        order = Order.objects.get(user=self.user, ordered=False)
+        return order, {line.item_id: line.quantity for line in order.items.all()}
+
+    def test_session_cart_becomes_the_order(self):
+        first, second, _ = self.items
+        self.add_anonymously(first, first, second)
+        self.assertFalse(Order.objects.exists())
+        self.log_in()
+
+        order, lines = self.open_lines()
+        self.assertEqual(lines, {first.pk: 2, second.pk: 1})
+        self.assertEqual(order.total, 2 * first.price + second.price)
+        self.assertNotIn(cart.SESSION_KEY, self.client.session)
+        self.assertEqual(caching.get_cart_count(self.user), 2)
+
+    def test_session_cart_is_added_to_an_existing_cart(self):
+        first, second, third = self.items
+        cart.add_item(self.user, first)
+        cart.add_item(self.user, third)
+        self.add_anonymously(first, second)
+        self.log_in()
+
+        order, lines = self.open_lines()
+        self.assertEqual(lines, {first.pk: 2, second.pk: 1, third.pk: 1})
+        self.assertEqual(order.total, 2 * first.price + second.price + third.price)
+        self.assertEqual(OrderItem.objects.filter(user=self.user, ordered=False).count(), 3)
+
+
+class HomeCatalogTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = create_items(25)
+
+    def setUp(self):
+        cache.clear()
+
+    def page(self, **params):
+        response = self.client.get(reverse('core:home'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj'], [item.pk for item in response.context['items']]
+
+    def test_pages_follow_the_cursors(self):
+        newest_first = sorted((item.pk for item in self.items), reverse=True)
+        first, pks = self.page()
+        self.assertEqual(pks, newest_first[:10])
+        self.assertFalse(first.has_previous())
+
+        second, pks = self.page(after=first.next_cursor)
+        self.assertEqual(pks, newest_first[10:20])
+        last, pks = self.page(after=second.next_cursor)
+        self.assertEqual(pks, newest_first[20:])
+        self.assertFalse(last.has_next())
+
+        back, pks = self.page(before=last.previous_cursor)
+        self.assertEqual(pks, newest_first[10:20])
+
+    def test_cached_page_is_replaced_when_the_catalog_changes(self):
+        self.page()
+        with self.assertNumQueries(0):
+            self.page()
+        new_item, = create_items(1, start=100)
+        page, pks = self.page()
+        self.assertEqual(pks[0], new_item.pk)
+
+
+class ProductCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.item, = create_items(1)
+
+    def test_item_is_read_once(self):
+        self.assertEqual(caching.get_item_by_slug(self.item.slug), self.item)
+        with self.assertNumQueries(0):
+            caching.get_item_by_slug(self.item.slug)
+        self.assertEqual(self.client.get(self.item.get_absolute_url()).status_code, 200)
+        self.assertEqual(self.client.get(reverse('core:api:details', args=[self.item.slug])).status_code, 200)
+
+    def test_saving_the_item_refreshes_its_page(self):
+        self.client.get(self.item.get_absolute_url())
+        self.item.title = 'Renamed Frame'
+        self.item.save()
+        self.assertContains(self.client.get(self.item.get_absolute_url()), 'Renamed Frame')
+
+    def test_old_slug_stops_resolving_after_a_rename(self):
+        old_url = self.item.get_absolute_url()
+        self.client.get(old_url)
+        self.item.slug = 'renamed-frame'
+        self.item.save()
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertEqual(self.client.get(self.item.get_absolute_url()).status_code, 200)
+
+
+class ImageVariantTests(MediaRootMixin, TestCase):
+
+    def test_new_upload_gets_every_variant(self):
+        item = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P',
+                                   fview=image_upload())
+        for variant, (width, height) in images.VARIANTS.items():
+            for extension in images.FORMATS:
+                name = images.variant_name(item.fview.name, variant, extension)
+                self.assertTrue(default_storage.exists(name), name)
+                with default_storage.open(name) as fp:
+                    image = Image.open(fp)
+                    self.assertLessEqual(image.width, width)
+                    self.assertLessEqual(image.height, height)
+        self.assertEqual(images.variant_url(item.fview, 'thumb', 'webp'),
+                         default_storage.url(images.variant_name(item.fview.name, 'thumb', 'webp')))
+        self.assertEqual(len(images.srcset(item.fview, 'jpg').split(', ')), len(images.VARIANTS))
+
+    def test_variants_are_only_generated_for_new_uploads(self):
+        item = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P',
+                                   fview=image_upload())
+        with mock.patch.object(images, 'generate_variants') as generate:
+            item.title = 'Renamed Frame'
+            item.save()
+            generate.assert_not_called()
+            item.sview = image_upload('side.jpg')
+            item.save()
+            generate.assert_called_once_with(item.sview)
+
+    def test_same_name_in_another_format_gets_its_own_variants(self):
+        jpeg = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P',
+                                   fview=image_upload('frame.jpg'))
+        png = Item.objects.create(title='Square Frame', price=100, slug='square-frame', category='FS', label='P',
+                                  fview=image_upload('frame.png', image_format='PNG'))
+        self.assertEqual(os.path.splitext(jpeg.fview.name)[0], os.path.splitext(png.fview.name)[0])
+        self.assertTrue(set(images.variant_names(jpeg.fview.name)).isdisjoint(images.variant_names(png.fview.name)))
+        for name in images.variant_names(jpeg.fview.name) + images.variant_names(png.fview.name):
+            self.assertTrue(default_storage.exists(name), name)
+
+    def test_replaced_image_loses_its_variants(self):
+        item = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P',
+                                   fview=image_upload())
+        old_variants = images.variant_names(item.fview.name)
+        item.fview = image_upload('front.jpg')
+        item.save()
+        for name in old_variants:
+            self.assertFalse(default_storage.exists(name), name)
+
+    def test_variants_of_an_image_another_item_shows_are_kept(self):
+        item = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P',
+                                   fview=image_upload())
+        Item.objects.create(title='Round Frame 2', price=100, slug='round-frame-2', category='FS', label='P',
+                            fview=item.fview.name)
+        item.fview = image_upload('front.jpg')
+        item.save()
+        for name in images.variant_names(Item.objects.get(slug='round-frame-2').fview.name):
+            self.assertTrue(default_storage.exists(name), name)
+
+    def test_missing_variant_falls_back_to_the_original(self):
+        name = default_storage.save('media/Item/plain.jpg', image_upload())
+        item = Item(fview=name)
+        self.assertEqual(images.variant_url(item.fview, 'card', 'webp'), item.fview.url)
+
+
+class PrescriptionUploadTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.item = Item.objects.create(title='Round Frame', price=100, slug='round-frame', category='FS', label='P')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        cart.add_item(self.user, self.item)
+        self.url = reverse('core:add_lenses', kwargs={'slug': self.item.slug})
+
+    def upload(self, image):
+        response = self.client.post(self.url, {'power_type': 'Z', 'lenses_type': 'HC', 'prescription_image': image})
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(settings.MEDIA_ROOT) for name in names]
+
+    def test_oversized_upload_is_refused(self):
+        with self.settings(PRESCRIPTION_UPLOAD_MAX_BYTES=1024):
+            messages = self.upload(image_upload('prescription.png', image_format='PNG'))
+        self.assertEqual(messages, ["The prescription image is too large!"])
+        self.assertFalse(EyeLenses.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_handler_stops_reading_once_over_the_limit(self):
+        request = RequestFactory().post(self.url)
+        handler = uploads.SizeLimitedUploadHandler(request, max_bytes=100)
+        self.assertEqual(handler.receive_data_chunk(b'x' * 60, 0), b'x' * 60)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'x' * 60, 60)
+        self.assertTrue(request.upload_too_large)
+
+    def test_accepted_upload_is_re_encoded(self):
+        with self.settings(PRESCRIPTION_MAX_DIMENSION=500):
+            messages = self.upload(image_upload('prescription.png', size=(1600, 400), image_format='PNG'))
+            self.assertEqual(messages, ["Success!"])
+            lenses = EyeLenses.objects.get()
+            original_name = lenses.prescription_image.name
+            self.assertFalse(lenses.processed)
+            # Runs after commit in the background; TestCase never commits
+            uploads.process_prescription(lenses.pk)
+        lenses.refresh_from_db()
+        self.assertTrue(lenses.processed)
+        self.assertTrue(lenses.prescription_image.name.endswith('.jpg'))
+        self.assertFalse(default_storage.exists(original_name))
+        with lenses.prescription_image.open() as fp:
+            image = Image.open(fp)
+            self.assertEqual((image.format, image.size), ('JPEG', (500, 125)))
+
+    def test_order_summary_etag_changes_once_the_upload_is_re_encoded(self):
+        self.upload(image_upload('prescription.png', image_format='PNG'))
+        url = reverse('core:api:order_summary')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        uploads.process_prescription(EyeLenses.objects.get().pk)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['items'][0]['lenses']['processed'])
+
+
+class ResizedImageTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = get_user_model().objects.create_user('customer', 'customer@example.com', 'password')
+        cls.other = get_user_model().objects.create_user('other', 'other@example.com', 'password')
+
+    def setUp(self):
+        super().setUp()
+        cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root)
+        patcher = mock.patch.object(views, 'image_cache', images.ResizeCache(cache_root, 10 ** 6))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.prescription = default_storage.save('user_prescription/scan.jpg', image_upload())
+        EyeLenses.objects.create(user=self.customer, prescription_image=self.prescription)
+
+    def get(self, path):
+        return self.client.get(reverse('core:resized_image', args=(320, 320, path)))
+
+    def test_product_image_is_public(self):
+        name = default_storage.save('media/Item/frame.jpg', image_upload())
+        response = self.get(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertLessEqual(max(image.size), 320)
+
+    def test_prescription_is_only_shown_to_its_owner_and_staff(self):
+        self.assertEqual(self.get(self.prescription).status_code, 404)
+        self.client.force_login(self.other)
+        self.assertEqual(self.get(self.prescription).status_code, 404)
+        self.client.force_login(self.customer)
+        response = self.get(self.prescription)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3600')
+
+    def test_dot_dot_path_to_a_prescription_is_still_private(self):
+        path = 'media/../' + self.prescription
+        self.assertEqual(self.get(path).status_code, 404)
+        self.client.force_login(self.customer)
+        response = self.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3600')
+
+    def test_only_listed_sizes_are_served(self):
+        name = default_storage.save('media/Item/frame.jpg', image_upload())
+        for width, height in settings.IMAGE_RESIZE_SIZES:
+            response = self.client.get(reverse('core:resized_image', args=(width, height, name)))
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('core:resized_image', args=(321, 320, name)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_paths_outside_media_root_are_not_found(self):
+        self.assertEqual(self.get('../manage.py').status_code, 404)
+
+
+class ResizeCacheTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.sources = []
+        for n in range(20):
+            source = os.path.join(self.root, f'source-{n}.png')
+            Image.effect_noise((100, 100), 50 + n).save(source)
+            self.sources.append(source)
+
+    def test_stays_within_budget_without_scanning_on_every_miss(self):
+        image_cache = images.ResizeCache(os.path.join(self.root, 'cache'), 60000)
+        with mock.patch.object(image_cache, 'entries', wraps=image_cache.entries) as entries:
+            for source in self.sources:
+                image_cache.get_or_create(source, 100, 100, 'jpg')
+        total = sum(entry.stat().st_size for entry in image_cache.entries())
+        self.assertLessEqual(total, 60000)
+        self.assertEqual(image_cache.size, total)
+        self.assertLess(entries.call_count, len(self.sources) / 2)
+
+    def test_least_recently_used_entries_go_first(self):
+        image_cache = images.ResizeCache(os.path.join(self.root, 'cache'), 10 ** 6)
+        paths = [image_cache.get_or_create(source, 100, 100, 'jpg')[1] for source in self.sources[:3]]
+        for age, path in enumerate(paths):
+            os.utime(path, (1000 - age, 1000 - age))
+        # Reading the oldest entry makes it the most recently used
+        image_cache.get_or_create(self.sources[2], 100, 100, 'jpg')
+        image_cache.max_bytes = os.path.getsize(paths[2]) / 0.9 + 1
+        image_cache.evict()
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True])
+
+
+class CatalogApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = create_items(12)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_pages_stay_stable_while_items_are_added(self):
+        url = reverse('core:api:home')
+        first = self.client.get(url, {'page_size': 5}).json()
+        self.assertEqual([item['id'] for item in first['results']], [item.pk for item in self.items[:-6:-1]])
+        create_items(3, start=100)
+        seen = [item['id'] for item in first['results']]
+        next_url = first['next']
+        while next_url:
+            page = self.client.get(next_url).json()
+            seen += [item['id'] for item in page['results']]
+            next_url = page['next']
+        self.assertEqual(seen, [item.pk for item in reversed(self.items)])
+
+    def test_sparse_fields(self):
+        response = self.client.get(reverse('core:api:home'), {'fields': 'title,slug'})
+        self.assertEqual(set(response.json()['results'][0]), {'title', 'slug'})
+        response = self.client.get(reverse('core:api:home'), {'fields': 'nonsense'})
+        self.assertIn('price', response.json()['results'][0])
+
+    def test_stream_returns_the_whole_catalog(self):
+        response = self.client.get(reverse('core:api:item_stream'), {'fields': 'id,slug'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         [{'id': item.pk, 'slug': item.slug} for item in self.items])
+
+
+class ConditionalApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(3)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def assertRevalidates(self, url, **params):
+        """
+        Fetches url, checks a repeat request with its ETag gets an empty 304,
+        and returns the ETag.
+        """
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        not_modified = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        return etag
+
+    def test_item_details(self):
+        item = self.items[0]
+        url = reverse('core:api:details', kwargs={'slug': item.slug})
+        etag = self.assertRevalidates(url)
+        self.assertNotEqual(self.assertRevalidates(url, fields='title'), etag)
+        item.price = 150
+        item.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog(self):
+        url = reverse('core:api:home')
+        etag = self.assertRevalidates(url)
+        create_items(1, start=100)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_summary_changes_with_every_cart_update(self):
+        url = reverse('core:api:order_summary')
+        item = self.items[0]
+        cart.add_item(self.user, item)
+        etags = [self.assertRevalidates(url)]
+        # Each of these writes with a queryset update rather than save()
+        for change in (lambda: cart.add_item(self.user, item),
+                       lambda: cart.remove_single_item(self.user, item),
+                       lambda: cart.attach_lenses(self.user, item, 'Z', 'HC', None),
+                       lambda: cart.detach_lenses(self.user, item)):
+            change()
+            etags.append(self.assertRevalidates(url))
+        self.assertEqual(len(set(etags)), len(etags))
+
+
+class OrderApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        UserProfile.objects.create(user=cls.user)
+        cls.items = create_items(3)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_order_summary_nests_its_lines(self):
+        cart.add_item(self.user, self.items[0])
+        cart.add_item(self.user, self.items[0])
+        cart.add_item(self.user, self.items[1])
+        order = cart.get_open_order(self.user)
+        order.coupon = Coupon.objects.create(code='SAVE10', percentage=10)
+        order.save()
+        data = self.client.get(reverse('core:api:order_summary')).json()
+        self.assertEqual(data['coupon'], 'SAVE10')
+        self.assertEqual(data['subtotal'], 301)
+        self.assertAlmostEqual(data['total'], 270.9)
+        lines = {line['item']['slug']: line for line in data['items']}
+        self.assertEqual(set(lines), {self.items[0].slug, self.items[1].slug})
+        self.assertEqual(lines[self.items[0].slug]['quantity'], 2)
+        self.assertEqual(lines[self.items[0].slug]['final_price'], 200)
+        self.assertIsNone(lines[self.items[0].slug]['lenses'])
+
+    def test_order_history_is_paginated_newest_first(self):
+        orders = [create_completed_order(self.user, self.items[:2]) for _ in range(5)]
+        url = reverse('core:api:user_profile')
+        seen = []
+        next_url = url + '?page_size=2'
+        while next_url:
+            data = self.client.get(next_url).json()
+            self.assertEqual(data['user_profile']['user'], self.user.pk)
+            page = data['orders']['results']
+            self.assertLessEqual(len(page), 2)
+            self.assertTrue(all(len(order['items']) == 2 for order in page))
+            seen += [order['id'] for order in page]
+            next_url = data['orders']['next']
+        self.assertEqual(seen, [order.pk for order in reversed(orders)])
+
+
+class ImportCatalogTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        with open(os.path.join(self.directory, 'round.jpg'), 'wb') as fp:
+            fp.write(image_upload().read())
+
+    def write_catalog(self, rows, name='catalog.jsonl'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fp:
+            fp.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def import_catalog(self, path, **options):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('prepopulate', path, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_batches_create_and_update_by_slug(self):
+        existing = Item.objects.create(title='Old Title', price=50, slug='round-frame-0', category='FS', label='P')
+        rows = [{'title': f'Round Frame {n}', 'price': 100 + n, 'category': 'FS'} for n in range(5)]
+        rows += [
+            {'title': 'Round Frame 4', 'price': 999, 'category': 'FS', 'fview': 'round.jpg'},
+            {'title': 'No Category', 'price': 10},
+            {'title': 'Bad Price', 'price': 'cheap', 'category': 'FS'},
+        ]
+        stdout, stderr = self.import_catalog(self.write_catalog(rows), batch_size=2)
+        self.assertIn('(4 created, 1 updated, 2 skipped)', stdout)
+        self.assertIn("Line 7: unknown category None", stderr)
+        self.assertIn("Line 8: price is not a number: 'cheap'", stderr)
+        existing.refresh_from_db()
+        self.assertEqual((existing.title, existing.price), ('Round Frame 0', 100))
+        # A slug repeated in the file: the last row wins
+        last = Item.objects.get(slug='round-frame-4')
+        self.assertEqual(last.price, 999)
+        self.assertTrue(default_storage.exists(last.fview.name))
+        self.assertEqual(Item.objects.count(), 5)
+        self.assertEqual(len(search.search('round frame')), 5)
+
+    def test_importing_the_same_file_again_changes_nothing(self):
+        path = os.path.join(self.directory, 'catalog.csv')
+        with open(path, 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['title', 'slug', 'price', 'discount_price', 'category', 'fview'])
+            for n in range(5):
+                writer.writerow([f'Round Frame {n}', '', 100 + n, '', 'FS', 'round.jpg'])
+        self.import_catalog(path, batch_size=2)
+        items = list(Item.objects.order_by('pk').values_list('pk', 'slug', 'price', 'fview'))
+        stored = os.listdir(os.path.join(settings.MEDIA_ROOT, Item._meta.get_field('fview').upload_to))
+
+        stdout, stderr = self.import_catalog(path, batch_size=2)
+        self.assertIn('(0 created, 5 updated, 0 skipped)', stdout)
+        self.assertEqual(stderr, '')
+        self.assertEqual(list(Item.objects.order_by('pk').values_list('pk', 'slug', 'price', 'fview')), items)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, Item._meta.get_field('fview').upload_to)),
+                         stored)
+
+
+class OrderAdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(2)
+        cls.orders = [create_completed_order(cls.user, cls.items) for _ in range(3)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def changelist(self, **params):
+        response = self.client.get(reverse('admin:core_order_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_shows_delivery_columns(self):
+        list_display = self.changelist().list_display
+        self.assertIn('delivered', list_display)
+        self.assertIn('received', list_display)
+
+    def test_search_matches_whole_values_only(self):
+        order = self.orders[1]
+        self.assertEqual(list(self.changelist(q=order.ref_code).result_list), [order])
+        self.assertEqual(self.changelist(q='shopper').result_count, 3)
+        self.assertEqual(self.changelist(q='shop').result_count, 0)
+        self.assertEqual(self.changelist(q='SHOPPER').result_count, 0)
+
+    def test_search_compares_the_columns_as_stored(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.changelist(q='shopper')
+        searches = [query['sql'] for query in queries if '"core_order"."ref_code" =' in query['sql']]
+        self.assertTrue(searches)
+        for sql in searches:
+            self.assertNotIn('UPPER', sql)
+            self.assertNotIn('LIKE', sql)
+
+    def test_refund_search_matches_a_whole_ref_code_or_part_of_an_email(self):
+        order = self.orders[0]
+        refund = Refund.objects.create(order=order, email='shopper@example.com', message='Wrong size')
+        Refund.objects.create(order=self.orders[1], email='other@example.com', message='Wrong size')
+        url = reverse('admin:core_refund_changelist')
+        for term, found in [(order.ref_code, [refund]), (order.ref_code[:-1], []), ('shopper@', [refund])]:
+            response = self.client.get(url, {'q': term})
+            self.assertEqual(list(response.context['cl'].result_list), found)
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(2)
+        address = Address.objects.create(user=cls.user, street_address='1 Main Street', apartment_address='Flat 1',
+                                         country='IN', zip_code='400001', address_type='S', default=True)
+        cls.refunded = create_completed_order(cls.user, cls.items)
+        cls.refunded.coupon = Coupon.objects.create(code='SAVE10', percentage=10)
+        cls.refunded.shipping_address = address
+        cls.refunded.payment = Payment.objects.create(user=cls.user, amount=180.9, transaction_id='ch_1')
+        cls.refunded.save()
+        cls.refunded.update_totals()
+        Refund.objects.create(order=cls.refunded, email='shopper@example.com', message='Wrong size', status='Q')
+        cls.plain = create_completed_order(cls.user, cls.items[:1])
+        cart.add_item(cls.user, cls.items[0])
+
+    def test_csv_has_a_row_per_line(self):
+        rows = list(csv.DictReader(''.join(exports.stream_csv(Order.objects.filter(ordered=True))).splitlines()))
+        self.assertEqual([row['order_id'] for row in rows], [str(self.refunded.pk)] * 2 + [str(self.plain.pk)])
+        first = rows[0]
+        self.assertEqual((first['coupon'], first['transaction_id'], first['refund_statuses'], first['country']),
+                         ('SAVE10', 'ch_1', 'Q', 'IN'))
+        self.assertEqual([row['item_slug'] for row in rows[:2]], [item.slug for item in self.items])
+        self.assertEqual((rows[2]['coupon'], rows[2]['transaction_id'], rows[2]['refund_ids']), ('', '', ''))
+
+    def test_jsonl_has_an_object_per_order(self):
+        lines = ''.join(exports.stream_jsonl(Order.objects.filter(ordered=True))).splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual([record['id'] for record in records], [self.refunded.pk, self.plain.pk])
+        record = records[0]
+        self.assertEqual((record['coupon'], record['coupon_percentage']), ('SAVE10', 10))
+        self.assertAlmostEqual(record['total'], 180.9)
+        self.assertEqual(record['payment']['transaction_id'], 'ch_1')
+        self.assertEqual([refund['status'] for refund in record['refunds']], ['Q'])
+        self.assertEqual(len(record['lines']), 2)
+        self.assertIsNone(records[1]['payment'])
+
+    def test_queries_do_not_grow_with_the_orders(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                list(exports.stream_jsonl(Order.objects.filter(ordered=True), chunk_size=100))
+            return len(queries)
+
+        before = count_queries()
+        for _ in range(5):
+            order = create_completed_order(self.user, self.items)
+            order.coupon = Coupon.objects.get()
+            order.payment = Payment.objects.create(user=self.user, amount=201, transaction_id='ch_2')
+            order.save()
+        self.assertEqual(count_queries(), before)
+
+    def test_command_filters_by_date(self):
+        Order.objects.filter(pk=self.plain.pk).update(order_date=timezone.now() - timedelta(days=10))
+        since = (timezone.localdate() - timedelta(days=1)).isoformat()
+        stdout = StringIO()
+        call_command('export_orders', '--format', 'jsonl', '--since', since, stdout=stdout)
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([record['id'] for record in records], [self.refunded.pk])
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def create_item(self, title, description='Plain frame.'):
+        return Item.objects.create(title=title, price=100, slug=f'item-{Item.objects.count()}',
+                                   category='FS', label='P', description=description, features='')
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('<b>The</b> Round-Frame GLASSES, for kids!'),
+                         ['round', 'frame', 'glasses', 'kids'])
+
+    def test_last_word_is_a_prefix(self):
+        self.create_item('Reading Glasses')
+        self.create_item('Glass Case')
+        self.create_item('Gold Frame')
+        self.assertEqual(sorted(search.query_terms('round gla')), ['gla', 'glass', 'glasses', 'round'])
+        self.assertEqual(sorted(search.query_terms('gla round')), ['gla', 'round'])
+
+    def test_title_match_ranks_first(self):
+        in_description = self.create_item('Gold Frame', 'Shaped like aviator glasses.')
+        in_title = self.create_item('Aviator Frame')
+        self.create_item('Round Frame')
+        self.assertEqual(search.search('aviator'), [in_title, in_description])
+
+    @override_settings(SEARCH_MAX_POSTINGS=6)
+    def test_rare_term_keeps_its_postings(self):
+        for n in range(10):
+            self.create_item(f'Frame {n}', 'Frame frame frame.')
+        rare = self.create_item('Titanium Frame')
+        self.assertEqual(search.search('frame titanium')[0], rare)
+
+    def test_stats_follow_the_index(self):
+        self.create_item('Round Frame')
+        self.assertEqual(search.index_stats()[0], 1)
+        with self.assertNumQueries(0):
+            search.index_stats()
+        item = self.create_item('Square Frame')
+        self.assertEqual(search.index_stats()[0], 2)
+        item.delete()
+        self.assertEqual(search.index_stats()[0], 1)
+
+
+class PaymentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        for item in self.items:
+            cart.add_item(self.user, item)
+
+    def test_card_payment_keeps_the_charge_id(self):
+        with mock.patch.object(views.stripe.Charge, 'create', return_value=mock.Mock(id='ch_123')) as create:
+            response = self.client.post(reverse('core:stripe_payment'), {'stripeToken': 'tok_visa'})
+        self.assertRedirects(response, reverse('core:home'), fetch_redirect_response=False)
+        self.assertEqual(create.call_args[1]['source'], 'tok_visa')
+        order = Order.objects.select_related('payment').get(user=self.user)
+        self.assertTrue(order.ordered)
+        self.assertEqual(order.payment.transaction_id, 'ch_123')
+
+    def test_a_later_paypal_order_does_not_get_an_earlier_charge(self):
+        with mock.patch.object(views.stripe.Charge, 'create', return_value=mock.Mock(id='ch_123')):
+            self.client.post(reverse('core:stripe_payment'), {'stripeToken': 'tok_visa'})
+        cart.add_item(self.user, self.items[0])
+        self.client.get(reverse('core:payment_done'))
+        order = Order.objects.select_related('payment').filter(user=self.user).latest('pk')
+        self.assertEqual(order.payment.transaction_id, str(order.pk))
+
+    def test_local_refund_clients_do_not_share_refunds(self):
+        first, second = refunds.LocalRefundClient(), refunds.LocalRefundClient()
+        first.refund(None, 'refund-1')
+        self.assertEqual(second.refunds, {})
+
+
+class FlakyRefundClient(refunds.LocalRefundClient):
+    """
+    Declines the payments in declined and raises a connection error on the
+    call numbered crash_on, like a processor outage mid-run.
+    """
+
+    def __init__(self, declined=(), crash_on=None):
+        super().__init__()
+        self.calls = []
+        self.savepoints = []
+        self.declined = declined
+        self.crash_on = crash_on
+
+    def refund(self, payment, idempotency_key):
+        self.calls.append(idempotency_key)
+        self.savepoints.append(len(connection.savepoint_ids))
+        if len(self.calls) == self.crash_on:
+            raise ConnectionError('processor unavailable')
+        if payment.pk in self.declined:
+            raise refunds.RefundError('charge already disputed')
+        return super().refund(payment, idempotency_key)
+
+
+class RefundProcessingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        cls.items = create_items(2)
+
+    def create_paid_orders(self, count):
+        orders = []
+        for n in range(count):
+            order = create_completed_order(self.user, self.items)
+            order.payment = Payment.objects.create(user=self.user, amount=201, transaction_id=f'ch_{n}')
+            order.refund_request = True
+            order.save()
+            Refund.objects.create(order=order, email='shopper@example.com', message='Wrong size')
+            orders.append(order)
+        return orders
+
+    def test_refunds_orders_in_chunks(self):
+        orders = self.create_paid_orders(5)
+        client = FlakyRefundClient()
+        self.assertEqual(refunds.queue_orders(Order.objects.all()), 5)
+        self.assertEqual(refunds.process_refunds(chunk_size=2, client=client), (5, 0))
+
+        self.assertEqual(len(client.calls), 5)
+        # No transaction is held open while the processor is called
+        self.assertEqual(set(client.savepoints), {len(connection.savepoint_ids)})
+        self.assertFalse(Order.objects.filter(refund_granted=False).exists())
+        self.assertFalse(Order.objects.filter(refund_request=True).exists())
+        self.assertEqual(Payment.objects.filter(refunded=True).count(), 5)
+        for refund in Refund.objects.all():
+            self.assertEqual(refund.status, 'D')
+            self.assertTrue(refund.accepted)
+            self.assertEqual(refund.processor_reference, f'local-refund-{refund.pk}')
+        self.assertEqual(sum(DailyItemSales.objects.values_list('refunded_units', flat=True)), 10)
+        # Nothing left to do
+        self.assertEqual(refunds.queue_orders(Order.objects.filter(pk=orders[0].pk)), 0)
+
+    def test_declined_refund_can_be_retried(self):
+        orders = self.create_paid_orders(2)
+        client = FlakyRefundClient(declined={orders[0].payment_id})
+        refunds.queue_orders(Order.objects.all())
+        self.assertEqual(refunds.process_refunds(client=client), (1, 1))
+
+        failed = Refund.objects.get(order=orders[0])
+        self.assertEqual((failed.status, failed.error, failed.attempts), ('F', 'charge already disputed', 1))
+        self.assertFalse(Order.objects.get(pk=orders[0].pk).refund_granted)
+
+        client.declined = ()
+        self.assertEqual(refunds.queue(Refund.objects.all()), 1)
+        self.assertEqual(refunds.process_refunds(client=client), (1, 0))
+        self.assertTrue(Order.objects.get(pk=orders[0].pk).refund_granted)
+
+    def test_resumes_after_crash_without_refunding_twice(self):
+        self.create_paid_orders(4)
+        client = FlakyRefundClient(crash_on=2)
+        refunds.queue_orders(Order.objects.all())
+        with self.assertRaises(ConnectionError):
+            refunds.process_refunds(chunk_size=3, client=client)
+        # The refund made before the outage is kept; the rest of the chunk
+        # stays processing and the next chunk was never claimed
+        self.assertEqual(Refund.objects.filter(status='D').count(), 1)
+        self.assertEqual(Refund.objects.filter(status='P').count(), 2)
+        self.assertEqual(Refund.objects.filter(status='Q').count(), 1)
+
+        client.crash_on = None
+        # Another run leaves the processing refunds alone until they go stale
+        self.assertEqual(refunds.process_refunds(client=client), (1, 0))
+        self.assertEqual(Refund.objects.filter(status='P').count(), 2)
+        with self.settings(REFUND_CLAIM_TIMEOUT=0):
+            self.assertEqual(refunds.process_refunds(client=client), (2, 0))
+        self.assertEqual(len(client.refunds), 4)
+        self.assertEqual(Payment.objects.filter(refunded=True).count(), 4)
+        self.assertFalse(Order.objects.filter(refund_granted=False).exists())
+        self.assertEqual(sum(DailyItemSales.objects.values_list('refunded_units', flat=True)), 8)
+
+    def test_unfinished_refunds_can_be_queued_again(self):
+        self.create_paid_orders(2)
+        refunds.queue_orders(Order.objects.all())
+        with self.assertRaises(ConnectionError):
+            refunds.process_refunds(client=FlakyRefundClient(crash_on=1))
+        stdout = StringIO()
+        with self.settings(REFUND_CLIENT='core.refunds.LocalRefundClient'):
+            call_command('process_refunds', '--requeue-processing', stdout=stdout)
+        self.assertIn('Queued 2 unfinished refunds again', stdout.getvalue())
+        self.assertEqual(Refund.objects.filter(status='D').count(), 2)
+
+    def rollups(self):
+        return sorted((row.date, row.item_id, row.category) + tuple(round(getattr(row, name), 6)
+                                                                    for name in reports.COUNTERS)
+                      for row in DailyItemSales.objects.all())
+
+    def test_rollups_match_a_rebuild(self):
+        orders = self.create_paid_orders(3)
+        for order in orders:
+            reports.record_sale(order, reports.sale_day(order))
+        granted_at = timezone.now() - timedelta(days=3)
+        refunds.queue_orders(Order.objects.filter(pk__in=[orders[0].pk, orders[1].pk]))
+        with mock.patch.object(timezone, 'now', return_value=granted_at):
+            refunds.process_refunds(client=FlakyRefundClient())
+        # Later changes to the order don't move its refund to another day
+        for order in Order.objects.all():
+            order.delivered = True
+            order.save()
+
+        incremental = self.rollups()
+        refund_days = {row[0] for row in incremental if row[-2]}
+        self.assertEqual(refund_days, {timezone.localdate(granted_at)})
+        reports.rebuild()
+        self.assertEqual(self.rollups(), incremental)
+        reports.rebuild(since=timezone.localdate())
+        self.assertEqual(self.rollups(), incremental)
+        reports.rebuild(since=timezone.localdate(granted_at))
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_rebuild_leaves_out_refunds_with_no_grant_date(self):
+        # Granted before grant times were recorded: its last change says
+        # nothing about when the refund was granted
+        order = self.create_paid_orders(1)[0]
+        Order.objects.filter(pk=order.pk).update(refund_request=False, refund_granted=True)
+        Refund.objects.filter(order=order).update(status='D', accepted=True)
+
+        reports.rebuild()
+        self.assertEqual(sum(DailyItemSales.objects.values_list('units', flat=True)), 2)
+        self.assertFalse(DailyItemSales.objects.filter(refunded_units__gt=0).exists())
+        self.assertEqual(list(reports.undated_refunds()), [order])
+        stdout = StringIO()
+        call_command('rebuild_sales_rollups', stdout=stdout)
+        self.assertIn('refunds of 1 orders with no recorded grant date', stdout.getvalue())
+
+    def test_granting_without_a_request_creates_the_refund(self):
+        order = create_completed_order(self.user, self.items)
+        order.payment = Payment.objects.create(user=self.user, amount=201, transaction_id='ch_1')
+        order.save()
+        self.assertEqual(refunds.queue_orders(Order.objects.all()), 1)
+        refunds.process_refunds(client=FlakyRefundClient())
+        refund = Refund.objects.get(order=order)
+        self.assertEqual((refund.status, refund.email), ('D', 'shopper@example.com'))
+
+
+@skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run the benchmarks')
+class BenchmarkTests(TestCase):
+    """
+    Fails when a benchmark is slower than core/benchmark_baseline.json by more
+    than BENCHMARK_THRESHOLD or runs more queries. BENCHMARK_SIZE picks the
+    data set (default small); record a baseline with
+    `manage.py run_benchmarks --update-baseline` on the machine that runs this.
+    """
+
+    def test_no_regressions(self):
+        size = os.getenv('BENCHMARK_SIZE', 'small')
+        baseline = benchmarks.load_baseline().get(size)
+        if not baseline:
+            self.skipTest(f'no {size} baseline recorded')
+        results = benchmarks.run(size)
+        self.assertEqual(benchmarks.compare(results, baseline), [])
@@ -0,0 +1,86 @@
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload, TemporaryFileUploadHandler
+from django.db import transaction
+from django.utils import timezone
+
+from . import images
+from .models import EyeLenses, Order
+
+
+class SizeLimitedUploadHandler(FileUploadHandler):
+    """
+    Stops reading the request body as soon as it grows past max_bytes, rather
+    than after the whole upload has been received. Sits in front of
+    TemporaryFileUploadHandler, which streams the accepted chunks to disk.
+    """
+
+    def __init__(self, request=None, max_bytes=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_bytes:
+            self.reject()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.reject()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def reject(self):
+        self.request.upload_too_large = True
+        raise StopUpload(connection_reset=True)
+
+
+def prescription_upload_handlers(request):
+    return [
+        SizeLimitedUploadHandler(request, settings.PRESCRIPTION_UPLOAD_MAX_BYTES),
+        TemporaryFileUploadHandler(request),
+    ]
+
+
+def request_too_large(request):
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return False
+    return content_length > settings.PRESCRIPTION_UPLOAD_MAX_BYTES
+
+
+def process_prescription(lenses_pk):
+    """
+    Re-encodes an uploaded prescription as a right-way-up JPEG no larger than
+    PRESCRIPTION_MAX_DIMENSION, replacing the original camera file.
+    """
+    lenses = EyeLenses.objects.filter(pk=lenses_pk, processed=False).first()
+    if lenses is None or not lenses.prescription_image:
+        return
+    field_file = lenses.prescription_image
+    original_name = field_file.name
+    with field_file.storage.open(original_name, 'rb') as fp:
+        image = images.open_image(fp)
+        image = images.resize(image, (settings.PRESCRIPTION_MAX_DIMENSION, settings.PRESCRIPTION_MAX_DIMENSION))
+    root, _ = os.path.splitext(original_name)
+    new_name = field_file.storage.save(root + '.jpg', ContentFile(images.encode(image, 'jpg', quality=85)))
+
+    with transaction.atomic():
+        updated = EyeLenses.objects.filter(pk=lenses_pk, processed=False).update(
+            prescription_image=new_name,
+            processed=True,
+        )
+        if updated:
+            # The order APIs show the image and processed flag, and their
+            # ETags follow Order.modified
+            Order.objects.filter(items__lenses_id=lenses_pk).update(modified=timezone.now())
+    if updated and new_name != original_name:
+        field_file.storage.delete(original_name)
+    elif not updated:
+        field_file.storage.delete(new_name)
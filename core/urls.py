@@ -6,7 +6,8 @@ from .views import (Home, Checkout, ProductDetail,
                 OrderSummary, remove_single_item_from_cart,
                 PayPalPayment, payment_done, payment_canceled, 
                 Search, AddCoupon, StripePayment, RefundRequest,
-                UserProfileView, AddLenses, RemoveLenses)
+                UserProfileView, AddLenses, RemoveLenses,
+                resized_image)
                 
 app_name = "core"
 handler404 = 'core.views.page_not_found_view'
@@ -29,6 +30,7 @@ urlpatterns = [
     path('search/',Search.as_view(), name='search'),
     path("refund-request/", RefundRequest.as_view(), name="refund_request"),
     path("user/", UserProfileView.as_view(), name="user_profile"),
+    path("img/<int:width>x<int:height>/<path:path>", resized_image, name="resized_image"),
 
 
     # REST API URL
@@ -1,21 +1,28 @@
 from django.shortcuts import render, get_object_or_404, redirect, reverse
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django.views.generic import TemplateView, DetailView, ListView, View
-from django.utils import timezone
 from django.contrib import messages
 from django.conf import settings
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.exceptions import ObjectDoesNotExist, SuspiciousFileOperation
 from paypal.standard.forms import PayPalPaymentsForm
-from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from decimal import Decimal
-from django.db.models import Q
 
+from . import caching, cart, reports, search, uploads
 from .forms import CheckoutForm, CouponForm, StripePaymentForm, RefundForm, LensesForm
-from .models import Item, Order, OrderItem, Address, Payment, Coupon, Refund, UserProfile, EyeLenses
+from .models import Item, Order, Address, Payment, Coupon, Refund, UserProfile, EyeLenses
+from .images import FORMATS, ResizeCache
+from .pagination import KeysetPaginator
 
 import stripe
-import random, string
+import os, random, string
 
 
 
@@ -30,6 +37,46 @@ def page_not_found_view(request, exception):
     return render(request, '404.html')
 
 
+image_cache = ResizeCache(settings.IMAGE_CACHE_ROOT, settings.IMAGE_CACHE_MAX_BYTES)
+
+
+def resized_image(request, width, height, path):
+    if (width, height) not in settings.IMAGE_RESIZE_SIZES:
+        raise Http404("Unsupported image size")
+    try:
+        source_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Image not found")
+    if not os.path.isfile(source_path):
+        raise Http404("Image not found")
+
+    # Prescriptions are private: only staff and the customer may see them.
+    # Check the normalized path, since "x/../user_prescription/..." is the same file.
+    name = os.path.relpath(source_path, settings.MEDIA_ROOT)
+    private = name.startswith(EyeLenses._meta.get_field('prescription_image').upload_to)
+    if private and not request.user.is_staff:
+        if not (request.user.is_authenticated and
+                EyeLenses.objects.filter(user=request.user, prescription_image=name).exists()):
+            raise Http404("Image not found")
+
+    extension = 'webp' if 'image/webp' in request.META.get('HTTP_ACCEPT', '') else 'jpg'
+    try:
+        key, cached_path = image_cache.get_or_create(source_path, width, height, extension)
+    except (OSError, ValueError):
+        raise Http404("Image could not be read")
+
+    etag = f'"{key}"'
+    last_modified = os.stat(source_path).st_mtime
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(open(cached_path, 'rb'), content_type=FORMATS[extension][1])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, max-age=3600' if private else 'public, max-age=86400'
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
 class Home(ListView):
     models = Item
     context_object_name = 'items'
@@ -37,12 +84,41 @@ class Home(ListView):
     template_name = "home_page.html"
     paginate_by = 10
 
-
-class OrderSummary(LoginRequiredMixin, View):
+    def get_cursor(self, name):
+        try:
+            return int(self.request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size)
+        after, before = self.get_cursor('after'), self.get_cursor('before')
+        key = caching.catalog_key('home', page_size, after, before)
+        page = cache.get(key)
+        if page is None:
+            page = paginator.page(after=after, before=before)
+            cache.set(key, page, caching.CATALOG_TIMEOUT)
+        page.paginator = paginator
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['catalog_version'] = caching.get_catalog_version()
+        context['catalog_size'] = context['paginator'].estimated_count()
+        return context
+
+
+class OrderSummary(View):
     context_object_name = 'cart'
     def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            session_cart = cart.SessionCart(request.session)
+            if len(session_cart):
+                return render(request, 'order_summary.html', {'cart': session_cart,})
+            messages.warning(request,"You don't have any items in your cart!")
+            return redirect('core:home')
         try:
-            order_item = Order.objects.get(user=self.request.user, ordered=False)
+            order_item = Order.objects.with_lines().get(user=self.request.user, ordered=False)
             return render(request, 'order_summary.html', {'cart': order_item,})
         except ObjectDoesNotExist:
             messages.warning(request,"You don't have any items in your cart!")
@@ -57,13 +133,11 @@ def is_valid_form(values):
         return valid
 
 
-class Checkout(View):
+class Checkout(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
-        qs = Order.objects.filter(user=self.request.user, ordered=False)
-        if qs.exists() and qs[0].items.count() > 0:
+        order = Order.objects.with_lines().filter(user=self.request.user, ordered=False).first()
+        if order is not None and order.items.all():
             try:
-                form = CheckoutForm()
-                order = Order.objects.get(user=self.request.user, ordered=False)
                 context = {
                     'form': CheckoutForm, 
                     "cart": order, 
@@ -163,115 +237,100 @@ class ProductDetail(DetailView):
     template_name = "product_page.html"
     context_object_name = 'product'
 
+    def get_object(self, queryset=None):
+        try:
+            return caching.get_item_by_slug(self.kwargs['slug'])
+        except Item.DoesNotExist:
+            raise Http404("No Item found matching the query")
+
 
-@login_required
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-            item=item,
-            user = request.user,
-            ordered=False
-        )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.info(request,"The Product is Updated to your cart!")
-            return redirect('core:order-summary')
-        else:
-            order.items.add(order_item)
-            messages.info(request,"The Product quantity is Added to your cart!")
-            return redirect('core:order-summary')
+    if request.user.is_authenticated:
+        order_item, created = cart.add_item(request.user, item)
     else:
-        order_date = timezone.now() 
-        order = Order.objects.create(user=request.user, order_date=order_date)
-        order.items.add(order_item)
+        created = cart.SessionCart(request.session).add_item(item)
+    if created:
         messages.info(request,"The Product is Added to your cart!")
-        return redirect('core:order-summary')
+    else:
+        messages.info(request,"The Product is Updated to your cart!")
     return redirect('core:order-summary')
 
 
-@login_required
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-            item=item,
-            user = request.user,
-            ordered=False
-        )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                            item=item,
-                            user = request.user,
-                            ordered=False
-                        )[0]
-            order.items.remove(order_item)
-            
-            order_item.delete()
-            order.save()
-            messages.info(request,"The Product is Removed from your cart!")
-            return redirect('core:order-summary')
-        else:
-            messages.info(request,"The Product was not in your cart!")
-            return redirect('core:product-detail', slug=slug)
+    if request.user.is_authenticated:
+        removed = cart.remove_item(request.user, item)
+        has_cart = removed or cart.get_open_order(request.user) is not None
+    else:
+        session_cart = cart.SessionCart(request.session)
+        removed = session_cart.remove_item(item)
+        has_cart = removed or len(session_cart) > 0
+
+    if removed:
+        messages.info(request,"The Product is Removed from your cart!")
+        return redirect('core:order-summary')
+    elif has_cart:
+        messages.info(request,"The Product was not in your cart!")
     else:
         messages.info(request,"You don't have any active order!") 
-        return redirect('core:product-detail', slug=slug)
     return redirect('core:product-detail', slug=slug)
 
 
-@login_required
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(
-        user=request.user,
-        ordered=False
-    )
-    if order_qs.exists():
-        order = order_qs[0]
-        # check if the order item is in the order
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False
-            )[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
-                order.save()
-            messages.info(request, "This item quantity was updated.")
-            return redirect("/")
-        else:
-            messages.info(request, "This item was not in your cart")
-            return redirect("core:product-detail", slug=slug)
+    if request.user.is_authenticated:
+        removed = cart.remove_single_item(request.user, item)
+        has_cart = removed or cart.get_open_order(request.user) is not None
+    else:
+        session_cart = cart.SessionCart(request.session)
+        removed = session_cart.remove_single_item(item)
+        has_cart = removed or len(session_cart) > 0
+
+    if removed:
+        messages.info(request, "This item quantity was updated.")
+        return redirect("/")
+    elif has_cart:
+        messages.info(request, "This item was not in your cart")
     else:
         messages.info(request, "You do not have an active order")
-        return redirect("core:product-detail", slug=slug)
+    return redirect("core:product-detail", slug=slug)
 
 
 class Search(View):
     paginate_by = 10
+    max_results = settings.SEARCH_MAX_RESULTS
+    related_items = settings.SEARCH_RELATED_ITEMS
+
     def get(self, request, *args, **kwargs):
         query = self.request.GET.get('query')
         submit = self.request.GET.get('submit')
         if query is not None:
-            lookups = Q(title__icontains=query) | Q(description__icontains=query)
-            results= Item.objects.filter(lookups).distinct()
-            context = {"results": results,'submitbutton': submit, 'Item':Item.objects.all()}
+            # Only the ids are ranked; Items are loaded for the current page only
+            ranked = search.rank(query, limit=self.max_results)
+            paginator = Paginator(ranked, self.paginate_by)
+            page_obj = paginator.get_page(self.request.GET.get('page'))
+            results = search.load_items(item_id for item_id, score in page_obj)
+            context = {
+                "results": results,
+                'submitbutton': submit,
+                'query': query,
+                'page_obj': page_obj,
+                'is_paginated': page_obj.has_other_pages(),
+                'related_items': self.get_related_items(results),
+            }
             return render(request, 'search_result.html', context)
         else:
             return render(request, 'search_result.html',{})
 
+    def get_related_items(self, results):
+        related = Item.objects.order_by('-pk')
+        if results:
+            related = related.filter(
+                category__in={item.category for item in results}
+            ).exclude(pk__in=[item.pk for item in results])
+        return related[:self.related_items]
+
 
 def get_coupon(request, code):
     try:
@@ -301,117 +360,77 @@ class AddCoupon(View):
                 return redirect('core:checkout')
 
 
-class AddLenses(View):
+@method_decorator(csrf_exempt, name='dispatch')
+class AddLenses(LoginRequiredMixin, View):
+    def dispatch(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            # Refuse oversized uploads before reading any of the body
+            if uploads.request_too_large(request):
+                messages.warning(request, "The prescription image is too large!")
+                return redirect('core:add_lenses', slug=self.kwargs['slug'])
+            # The upload handlers have to be in place before anything reads
+            # request.POST, so the CSRF check runs here instead of in the middleware
+            request.upload_handlers = uploads.prescription_upload_handlers(request)
+        return csrf_protect(super().dispatch)(request, *args, **kwargs)
+
     def get(self, request, *args, **kwargs):
         slug = self.kwargs['slug']
         item = get_object_or_404(Item, slug=slug)
-        order_item, created = OrderItem.objects.get_or_create(
-                item=item,
-                user = request.user,
-                ordered=False
-            )
-        order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-        if order_qs.exists():
-            order = order_qs[0]
-            product = order.items.filter(item__slug=item.slug)
-            if product.exists():
-                context = {
-                    "form" : LensesForm(),
-                    "product": product[0],
-                }
-                return render(request, 'lenses_requirements.html', context)
-            else:
-                messages.info(request,"The Product is not in your cart!")
-                return redirect('core:product-detail', slug=slug)
+        product = cart.get_line(request.user, item)
+        if product is not None:
+            context = {
+                "form" : LensesForm(),
+                "product": product,
+            }
+            return render(request, 'lenses_requirements.html', context)
         else:
             messages.info(request,"The Product is not in your cart!")
             return redirect('core:product-detail', slug=slug)
-        return redirect('core:order-summary')
 
     def post(self, request, *args, **kwargs):
         slug = self.kwargs["slug"]
         item = get_object_or_404(Item, slug=slug)
-        order_item, created = OrderItem.objects.get_or_create(
-                item=item,
-                user = request.user,
-                ordered=False
+        form = LensesForm(self.request.POST, self.request.FILES)
+        if form.is_valid():
+            product = cart.attach_lenses(
+                self.request.user,
+                item,
+                power_type = form.cleaned_data["power_type"],
+                lenses_type = form.cleaned_data["lenses_type"],
+                prescription_image = form.cleaned_data["prescription_image"],
             )
-        order_qs = Order.objects.filter(user=request.user, ordered=False)
-
-        if order_qs.exists():
-            order = order_qs[0]
-            product = order.items.filter(item__slug=item.slug)
-            if product.exists():
-                product = product[0]
-                form = LensesForm(self.request.POST, self.request.FILES)
-                if form.is_valid():
-                    try:
-                        product.lenses_required = True
-                        product.lenses = EyeLenses.objects.create(
-                            power_type = form.cleaned_data["power_type"],
-                            lenses_type = form.cleaned_data["lenses_type"],
-                            prescription_image = form.cleaned_data["prescription_image"],
-                            user = self.request.user
-                        )
-                        product.save()
-                        messages.info(request,"Success!")
-                        return redirect('core:add_lenses', slug=slug)
-                    except:
-                        messages.info(request,"Exception Occurs!")
-                        return redirect('core:add_lenses', slug=slug)
-                else:
-                    messages.info(request,"else 1!")
-                    return redirect('core:add_lenses', slug=slug)
+            if product is not None:
+                messages.info(request,"Success!")
             else:
-                messages.info(request,"else 2!")
-                return redirect('core:add_lenses', slug=slug)
+                messages.info(request,"The Product is not in your cart!")
+        elif getattr(request, 'upload_too_large', False):
+            messages.warning(request, "The prescription image is too large!")
         else:
-            messages.info(request,"else 3!")
-            return redirect('core:add_lenses', slug=slug)
+            messages.info(request,"Please upload a valid prescription image!")
+        return redirect('core:add_lenses', slug=slug)
 
 
-class RemoveLenses(View):
+class RemoveLenses(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         slug = self.kwargs["slug"]
         item = get_object_or_404(Item, slug=slug)
-        order_qs = Order.objects.filter(
-            user=self.request.user,
-            ordered=False
-        )
-        if order_qs.exists():
-            order = order_qs[0]
-            # check if the order item is in the order
-            if order.items.filter(item__slug=item.slug).exists():
-                product = OrderItem.objects.filter(
-                    item=item,
-                    user=self.request.user,
-                    ordered=False
-                )[0]
-                if product.lenses_required:
-                    product.lenses_required = False
-                    product.lenses.delete()
-                    product.lenses = None
-                    product.save()                 
-                    messages.info(request,"Successully Removed the Lenses")
-                    return redirect("core:add_lenses", slug=slug)
-                else:
-                    messages.info(request,"You don't have attached Lenses to this product")
-                    return redirect("core:add_lenses", slug=slug)
-            else:
-                messages.info(request,"Can't Find this Product in your cart")
-                return redirect("core:order-summary")
-
+        product, removed = cart.detach_lenses(self.request.user, item)
+        if removed:
+            messages.info(request,"Successully Removed the Lenses")
+            return redirect("core:add_lenses", slug=slug)
+        elif product is not None:
+            messages.info(request,"You don't have attached Lenses to this product")
+            return redirect("core:add_lenses", slug=slug)
         else:
-            messages.info(request,"Your Cart seems to be empty")
-            return redirect("core:home")
+            messages.info(request,"Can't Find this Product in your cart")
+            return redirect("core:order-summary")
 
 
 
 class PayPalPayment(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
-        order = Order.objects.get(user=request.user, ordered=False)
-        if order.billing_address:
+        order = Order.objects.with_lines().get(user=request.user, ordered=False)
+        if order.shipping_address_id:
             host = request.get_host()
             paypal_dict = {
                 'business': settings.PAYPAL_RECEIVER_EMAIL,
@@ -435,33 +454,41 @@ class PayPalPayment(LoginRequiredMixin, View):
                 'DISPLAY_COUPON_FORM':False}
             )
         else:
-            messages.warning(request, "You must have Billing Address to your order!")
+            messages.warning(request, "You must have Shipping Address to your order!")
             return redirect('core:checkout')
 
 
-@csrf_exempt
-def payment_done(request):
-    order = Order.objects.get(user=request.user, ordered=False)
-    order_item = order.items.all()
-    order_item.update(ordered=True)
-    for item in order_item:
-        item.save()
-    
+def complete_order(request, order, transaction_id):
+    """
+    Marks the cart as paid with a Payment for transaction_id, the id that
+    refunds are later sent to the payment processor with.
+    """
+    order.items.update(ordered=True)
+
     payment_receipt = Payment.objects.create(
         user=request.user,
         amount = order.get_total_bill_amount_with_discount(), 
-        transaction_id=order.id
+        transaction_id=transaction_id
     )
     payment_receipt.save()
     order.ordered = True
     order.ref_code = create_ref_code()
     order.payment = payment_receipt
     order.save()
+    reports.record_sale(order)
+    caching.invalidate_cart_count(request.user.pk)
 
     messages.info(request,"Order Successfully Done!")
     return redirect("core:home")
 
 
+@csrf_exempt
+def payment_done(request):
+    # PayPal's return page; the IPN has the PayPal transaction, not this request
+    order = Order.objects.get(user=request.user, ordered=False)
+    return complete_order(request, order, order.id)
+
+
 @csrf_exempt
 def payment_canceled(request):
     messages.info(request,"Order Cancelled!")
@@ -470,7 +497,7 @@ def payment_canceled(request):
 
 class StripePayment(View):
     def get(self, *args, **kwargs):
-        order = Order.objects.get(user=self.request.user, ordered=False)
+        order = Order.objects.with_lines().get(user=self.request.user, ordered=False)
         context = {
                 'order': order,
                 "cart": order,
@@ -486,8 +513,8 @@ class StripePayment(View):
         currency="inr",
         source=token,
         )
-
-        return redirect('core:payment_done')
+        # The charge id goes on the Payment so the charge can be refunded
+        return complete_order(request, order, charge.id)
 
 
 class RefundRequest(View):
@@ -545,10 +572,9 @@ class UserProfileView(LoginRequiredMixin, View):
     template_name = "user_profile.html"
     model = UserProfile
     def get(self, request, *args, **kwargs):
-        order = Order.objects.filter(user=self.request.user, ordered=True)
         context = {
-            "user_profile" : UserProfile.objects.get(user=self.request.user), 
-            "orders": Order.objects.filter(user=self.request.user, ordered=True)
+            "user_profile" : UserProfile.objects.select_related('user').get(user=self.request.user), 
+            "orders": Order.objects.with_lines().filter(user=self.request.user, ordered=True)
         }
         return render(request, self.template_name, context)
     
\ No newline at end of file
@@ -48,6 +48,10 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # gzip (or brotli, if installed) for the JSON API only
+    'core.middleware.APICompressionMiddleware',
+    # Query count and timing per request for core views
+    'core.middleware.QueryCountMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -95,6 +99,14 @@ DATABASES = {
     }
 }
 
+# Cart badge counts and catalog pages are cached here. Use a shared backend
+# (memcached/redis) when running more than one process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
 if ENVIRONMENT == 'production':
     DEBUG = False
     SECRET_KEY = os.getenv('SECRET_KEY')
@@ -132,5 +144,57 @@ PAYPAL_BUY_BUTTON_IMAGE = "http://www.readyshoppingcart.com/wp-content/uploads/2
 
 STRIPE_SECRET_KEY = "XXX"
 
+# Payment processor client that core.refunds sends granted refunds through.
+# The local client only records them; use core.refunds.StripeRefundClient live.
+REFUND_CLIENT = 'core.refunds.LocalRefundClient'
+# Seconds before a refund left processing by a run that died is sent again
+REFUND_CLAIM_TIMEOUT = 15 * 60
+
+# On-demand image resizing (/img/<w>x<h>/<path>)
+IMAGE_CACHE_ROOT = os.path.join(BASE_DIR, 'image_cache')
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# The only sizes /img/ produces (width, height); anything else is a 404, so
+# the server can't be made to resize an image in countless different ways
+IMAGE_RESIZE_SIZES = [
+    (80, 80),     # admin prescription thumbnails
+    (320, 320),   # catalog cards
+    (600, 600),   # admin prescription preview
+    (640, 640),   # catalog cards on high-density screens
+]
+
+# Prescription uploads (AddLenses)
+PRESCRIPTION_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+PRESCRIPTION_MAX_DIMENSION = 2000
+
+# Threads for post-request work such as re-encoding uploads (core.tasks)
+BACKGROUND_WORKERS = 2
+
+# One JSON line per request on core.performance (see QueryCountMiddleware).
+# In development the same numbers are sent as X-Query-* response headers.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.performance': {
+            'handlers': ['console'],
+            'level': os.getenv('PERFORMANCE_LOG_LEVEL', 'WARNING' if DEBUG else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# core.benchmarks fails a benchmark that gets this many times slower than its baseline
+BENCHMARK_THRESHOLD = 2.0
+
+# Search
+SEARCH_MAX_RESULTS = 200
+SEARCH_MAX_POSTINGS = 20000
+SEARCH_RELATED_ITEMS = 4
+
 
 SECRET_KEY = 'XXX'
\ No newline at end of file